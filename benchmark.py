@@ -0,0 +1,164 @@
+# Thread-topology benchmark
+# Input parameters (-m model, -l lexicon, -t intra-op threads, -i inter-op threads)
+# Trains and scores a model with every thread setting, each one in a fresh process
+# (TensorFlow fixes its thread pools when it starts), to choose the settings of a node type
+
+import loaddata
+import buildmodel
+import calibrate
+import evaluate
+import parallel
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import tensorflow as tf
+import random
+
+# Training throughput and inference latency of the current thread setting
+def measure_setting(args):
+  model, x, y, _ = calibrate.prepare(args.model, args.lexicon, args.dataset, args.samples)
+  samples_per_sec, peak_rss = calibrate.measure(model, x, y, args.batch_size)
+  batch_time, single_time = evaluate.time_inference(model, x, args.batch_size)
+
+  return {'samples_per_sec': samples_per_sec,
+          'batch_ms_per_tweet': batch_time * 1000,
+          'single_tweet_ms': single_time * 1000,
+          'peak_rss_mb': peak_rss / 2**20}
+
+# Run one setting in a child process
+def run_setting(args, threads, inter_threads):
+  with tempfile.TemporaryDirectory() as tmp:
+    output = os.path.join(tmp, 'setting.json')
+    argv = [sys.executable, sys.argv[0],
+            '-m', args.model,
+            '-d', args.dataset,
+            '--samples', str(args.samples),
+            '--batch_size', str(args.batch_size),
+            '--setting', str(threads), str(inter_threads),
+            '-o', output]
+    if args.lexicon:
+      argv += ['-l', args.lexicon]
+
+    # Pin the child to its first `threads` cores
+    env = dict(os.environ)
+    cores = sorted(os.sched_getaffinity(0))
+    if args.pin and len(cores) >= threads:
+      env[parallel.AFFINITY] = ','.join(str(core) for core in cores[:threads])
+
+    subprocess.run(argv, env=env, check=True)
+    with open(output) as f:
+      return json.load(f)
+
+def main(args):
+  # Child process: measure the setting it was started with
+  if args.setting:
+    result = measure_setting(args)
+    with open(args.output, 'w') as f:
+      json.dump(result, f)
+    return
+
+  results = []
+  for threads in args.threads:
+    for inter_threads in args.inter_threads:
+      result = run_setting(args, threads, inter_threads)
+      result.update({'threads': threads, 'inter_threads': inter_threads})
+      results.append(result)
+
+  fastest_training = max(results, key=lambda r: r['samples_per_sec'])
+  fastest_inference = min(results, key=lambda r: r['single_tweet_ms'])
+
+  print("----------------------------------------------")
+  print(f"Thread benchmark ({args.model}, {args.lexicon} lexicon, batch size {args.batch_size}, {parallel.available_cores()} cores):")
+  print("> intra | inter | train samples/s | batch ms/tweet | single-tweet ms | peak RSS (MB)")
+  for r in results:
+    print(f"> {r['threads']:5d} | {r['inter_threads']:5d} | {r['samples_per_sec']:15.1f} | {r['batch_ms_per_tweet']:14.3f} | {r['single_tweet_ms']:15.2f} | {r['peak_rss_mb']:13.1f}")
+  print(f"> Fastest training: --threads {fastest_training['threads']} --inter_threads {fastest_training['inter_threads']}")
+  print(f"> Fastest single-tweet inference: --threads {fastest_inference['threads']} --inter_threads {fastest_inference['inter_threads']}")
+  print("----------------------------------------------")
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'model': args.model, 'lexicon': args.lexicon, 'cores': parallel.available_cores(),
+                 'batch_size': args.batch_size, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-m",
+                  "--model",
+                  choices=list(buildmodel.MODELS),
+                  default='lstm',
+                  help="Model to benchmark")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=['liwc', 'sel', 'emolex', 'isal', 'all'],
+                  default=None,
+                  help="Name of the lexicon to infuse")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset to train with")
+
+  ap.add_argument("-t",
+                  "--threads",
+                  type=int,
+                  nargs='+',
+                  default=[1, 2, 4, 8],
+                  help="Intra-op threads to sweep")
+
+  ap.add_argument("-i",
+                  "--inter_threads",
+                  type=int,
+                  nargs='+',
+                  default=[1, 2],
+                  help="Inter-op threads to sweep")
+
+  ap.add_argument("--batch_size",
+                  type=int,
+                  default=64,
+                  help="Training and scoring batch size")
+
+  ap.add_argument("--samples",
+                  type=int,
+                  default=2048,
+                  help="Training tweets per measured epoch")
+
+  ap.add_argument("--pin",
+                  action='store_true',
+                  help="Pin every setting to as many cores as intra-op threads")
+
+  ap.add_argument("--setting",
+                  type=int,
+                  nargs=2,
+                  default=None,
+                  help=argparse.SUPPRESS)
+
+  ap.add_argument("-o",
+                  "--output",
+                  default=None,
+                  help="JSON file to store the measurements")
+
+  args = ap.parse_args()
+
+  if args.setting:
+    parallel.configure_threads(args.setting[0], args.setting[1])
+  main(args)
@@ -1,14 +1,22 @@
 from tensorflow import keras
 from tensorflow.keras import layers, initializers
+import kerastuner as kt
+
 from kerastuner import HyperModel
 
 # Metrics
-METRICS=[
-	keras.metrics.BinaryAccuracy(name='accuracy'),
-	keras.metrics.Precision(name='precision'),
-	keras.metrics.Recall(name='recall'),
-	keras.metrics.AUC(name='auc')
-]
+def new_metrics():
+    return [
+        keras.metrics.BinaryAccuracy(name='accuracy'),
+        keras.metrics.Precision(name='precision'),
+        keras.metrics.Recall(name='recall'),
+        keras.metrics.AUC(name='auc')
+    ]
+
+METRICS=new_metrics()
+
+# Batch sizes tuned by the search scripts
+BATCH_SIZES = [8, 16, 32, 64, 128, 256]
 
 class LSTMModel(HyperModel):
 
@@ -269,4 +277,128 @@ class LSTMFeaturesModel(HyperModel):
                     optimizer=keras.optimizers.Adam(hp.Choice('learning_rate', values=[1e-2, 2e-2, 1e-3, 2e-3])), 
                     metrics=self.metrics)
 
-        return model
\ No newline at end of file
+        return model
+
+
+# Bag of embeddings (+ features)
+# Pools the frozen embeddings instead of running a recurrent/convolutional layer
+class BowModel(HyperModel):
+    def __init__(self, vocab_size, max_seq, embedding_matrix, emb_dim, num_emotions=None, metrics=METRICS):
+        self.vocab_size = vocab_size
+        self.max_seq = max_seq
+        self.embedding_matrix = embedding_matrix
+        self.emb_dim = emb_dim
+        self.num_emotions = num_emotions
+        self.metrics = metrics
+
+    def build(self, hp):
+        # Input layer (shape = num_docs, max_seq)
+        inputs = [keras.Input(shape=(self.max_seq,), dtype='float64', name='Input_A')]
+
+        pooling = hp.Choice('pooling', values=['mean', 'max'])
+
+        # Embedding layer with pretrained weights (padding is masked out of the mean)
+        embedding = layers.Embedding(self.vocab_size,
+                                    self.emb_dim,
+                                    embeddings_initializer=initializers.Constant(self.embedding_matrix),    # Pretrained weights
+                                    input_length=self.max_seq,
+                                    mask_zero=(pooling == 'mean'),
+                                    trainable=False,
+                                    name='Embedding')(inputs[0])    # This makes the weights not getting overwritten
+
+        # Pooling
+        if pooling == 'mean':
+            x = layers.GlobalAveragePooling1D()(embedding)
+        else:
+            x = layers.GlobalMaxPool1D()(embedding)
+
+        # Lexicon features
+        if self.num_emotions:
+            inputs.append(keras.Input(shape=(self.num_emotions,), name='Input_B'))
+            x = layers.Concatenate()([x, inputs[1]])
+
+        # Dense layer
+        dense = layers.Dense(hp.Int('dense_units',
+                                    min_value=32,
+                                    max_value=256,
+                                    step=32),
+                            activation=hp.Choice('dense_activation', values=['relu', 'tanh']),
+                            kernel_initializer=keras.initializers.glorot_uniform(seed=66))(x)
+
+        # Dropout layer
+        dropout = layers.Dropout(rate=hp.Choice('do_rate', values=[0.25, 0.5]))(dense)
+
+        # Output binary (sigmoid) classification layer
+        x = layers.Dense(1, activation='sigmoid', name='Binary_Classifier')(dropout)
+
+        # Model compilation
+        model = keras.Model(inputs=inputs, outputs=x, name='functional_model')
+        model.compile(loss='binary_crossentropy',
+                    optimizer=keras.optimizers.Adam(hp.Choice('learning_rate', values=[1e-2, 2e-2, 1e-3, 2e-3])),
+                    metrics=self.metrics)
+
+        return model
+
+# HyperModels by command line name (BowModel also takes the features)
+MODELS = {
+    'lstm': LSTMModel,
+    'bilstm': BiLSTMModel,
+    'cnn': CNNModel,
+    'bow': BowModel
+}
+
+# HyperModel used by the search scripts for a model name and lexicon size
+def get_hypermodel(name, vocab_size, max_seq, embedding_matrix, emb_dim, num_emotions=None, metrics=METRICS):
+    if name == 'bow':
+        return BowModel(vocab_size, max_seq, embedding_matrix, emb_dim, num_emotions, metrics)
+    elif num_emotions:
+        return LSTMFeaturesModel(vocab_size, max_seq, embedding_matrix, emb_dim, num_emotions, metrics)
+    return MODELS[name](vocab_size, max_seq, embedding_matrix, emb_dim, metrics)
+
+# Reload the best model of a finished search from its trials directory
+def load_best_model(hypermodel, directory, project_name, objective='val_accuracy'):
+    tuner = kt.RandomSearch(hypermodel,
+                            objective=kt.Objective(objective, direction='max'),
+                            max_trials=1,
+                            directory=directory,
+                            project_name=project_name,
+                            overwrite=False)
+    return tuner.get_best_models(num_models=1)[0]
+
+# Small and fast student models for distillation
+# kind: 'cnn' (single convolution) or 'mlp' (averaged embeddings)
+# They share the frozen embedding matrix and, optionally, the lexicon features
+def build_student(kind, vocab_size, max_seq, embedding_matrix, emb_dim, num_emotions=None, units=64):
+    inputs = [keras.Input(shape=(max_seq,), dtype='int32', name='Input_A')]
+
+    x = layers.Embedding(vocab_size,
+                        emb_dim,
+                        embeddings_initializer=initializers.Constant(embedding_matrix),
+                        input_length=max_seq,
+                        mask_zero=(kind == 'mlp'),
+                        trainable=False,
+                        name='Embedding')(inputs[0])
+
+    if kind == 'cnn':
+        x = layers.Convolution1D(units, 3, activation='relu')(x)
+        x = layers.GlobalMaxPool1D()(x)
+    elif kind == 'mlp':
+        x = layers.GlobalAveragePooling1D()(x)
+    else:
+        raise ValueError("Unknown student: " + str(kind))
+
+    # Lexicon features
+    if num_emotions:
+        inputs.append(keras.Input(shape=(num_emotions,), name='Input_B'))
+        x = layers.Concatenate()([x, inputs[1]])
+
+    x = layers.Dense(units, activation='relu', kernel_initializer=keras.initializers.glorot_uniform(seed=66))(x)
+    x = layers.Dense(1, activation='sigmoid', name='Binary_Classifier')(x)
+
+    # Trained on the teacher's probabilities (soft targets)
+    model = keras.Model(inputs=inputs, outputs=x, name='student_' + kind)
+    model.compile(loss='binary_crossentropy',
+                optimizer=keras.optimizers.Adam(1e-3),
+                metrics=[keras.metrics.MeanAbsoluteError(name='mae')])
+
+    return model
@@ -0,0 +1,178 @@
+# Batch-size calibration
+# Input parameters (-m model, -l lexicon, -b batch sizes)
+# Measures the training throughput and peak memory of a model for every batch size on this node
+# and suggests the batch sizes worth tuning (--batch_sizes of run.py and run_cv.py)
+
+import loadembeddings
+import loaddata
+import buildmodel
+import crossval
+import parallel
+
+import argparse
+import json
+import numpy as np
+import tensorflow as tf
+import kerastuner as kt
+import random, time
+
+# Training samples per second and peak resident memory (bytes) of one epoch
+def measure(model, x, y, batch_size):
+  model.fit(x, y, batch_size=batch_size, epochs=1, verbose=0)    # Warm up (graph tracing)
+
+  parallel.reset_peak_rss()
+  start = time.perf_counter()
+  model.fit(x, y, batch_size=batch_size, epochs=1, verbose=0)
+  seconds = time.perf_counter() - start
+
+  return len(y) / seconds, parallel.rss(peak=True)
+
+# Batch sizes whose throughput is at least `min_efficiency` times the best one
+def efficient_batch_sizes(results, min_efficiency=0.5):
+  best = max(r['samples_per_sec'] for r in results)
+  return [r['batch_size'] for r in results if r['samples_per_sec'] >= min_efficiency * best]
+
+# HyperModel of the search scripts and the training set (sequences and lexicon features)
+def prepare_hypermodel(model_name, lexicon, dataset):
+  # Data loading
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(dataset)
+  lex_train, = loaddata.load_lexicon(lexicon, [x_train])
+
+  # Same tokenizer as the searches
+  max_seq = loaddata.MAX_SEQ
+  tokenizer = loaddata.fit_tokenizer(x_train)
+  word_index = tokenizer.word_index
+  vocab_size = len(word_index) + 1
+  seq_train = loaddata.to_sequences(tokenizer, x_train, max_seq)
+
+  # Load embeddings
+  path = '../embeddings/embeddings-l-model.vec'
+  EMB_DIM = 300
+  LIMIT = 100000
+  embedding_matrix = loadembeddings.load_suc(path, word_index, EMB_DIM, LIMIT)
+
+  num_emotions = len(lex_train.columns) if lexicon else None
+  hypermodel = buildmodel.get_hypermodel(model_name, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions)
+
+  return hypermodel, seq_train, lex_train, y_train
+
+# Model with the default hyperparameters of the search space and a calibration subset
+# of the training set
+# Returns: the model, its inputs, the labels and the size of the whole training set
+def prepare(model_name, lexicon, dataset, samples):
+  hypermodel, seq_train, lex_train, y_train = prepare_hypermodel(model_name, lexicon, dataset)
+  model = hypermodel.build(kt.HyperParameters())
+
+  n = min(samples, len(seq_train))
+  x = loaddata.model_inputs(seq_train[:n], None if lex_train is None else lex_train[:n])
+  y = np.asarray(y_train)[:n]
+
+  return model, x, y, len(seq_train)
+
+def main(args):
+  model, x, y, train_size = prepare(args.model, args.lexicon, args.dataset, args.samples)
+  initial_weights = model.get_weights()
+  n = len(y)
+
+  results = []
+  for batch_size in args.batch_sizes:
+    # Every batch size starts from the same weights
+    crossval.reset_model(model, initial_weights)
+    samples_per_sec, peak_rss = measure(model, x, y, batch_size)
+
+    # Training time of a whole trial with this batch size
+    trial_hours = train_size * args.epochs * args.folds / samples_per_sec / 3600
+    results.append({'batch_size': batch_size,
+                    'samples_per_sec': samples_per_sec,
+                    'peak_rss_mb': peak_rss / 2**20,
+                    'trial_hours': trial_hours})
+
+  best = max(r['samples_per_sec'] for r in results)
+  efficient = efficient_batch_sizes(results, args.min_efficiency)
+
+  print("----------------------------------------------")
+  print(f"Batch-size calibration ({args.model}, {args.lexicon} lexicon, {n} tweets, {parallel.available_cores()} cores):")
+  print("> batch size | samples/s | vs best | peak RSS (MB) | hours/trial")
+  for r in results:
+    print(f"> {r['batch_size']:10d} | {r['samples_per_sec']:9.1f} | {r['samples_per_sec'] / best:7.2f} | {r['peak_rss_mb']:13.1f} | {r['trial_hours']:11.2f}")
+  print(f"> Efficient batch sizes (>= {args.min_efficiency:.0%} of the best throughput): --batch_sizes {' '.join(str(b) for b in efficient)}")
+  print("----------------------------------------------")
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'model': args.model, 'lexicon': args.lexicon, 'cores': parallel.available_cores(),
+                 'results': results, 'efficient': efficient}, f, indent=2)
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-m",
+                  "--model",
+                  choices=list(buildmodel.MODELS),
+                  default='lstm',
+                  help="Model to calibrate")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=['liwc', 'sel', 'emolex', 'isal', 'all'],
+                  default=None,
+                  help="Name of the lexicon to infuse")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset to train with")
+
+  ap.add_argument("-b",
+                  "--batch_sizes",
+                  type=int,
+                  nargs='+',
+                  default=buildmodel.BATCH_SIZES,
+                  help="Batch sizes to measure")
+
+  ap.add_argument("--samples",
+                  type=int,
+                  default=2048,
+                  help="Training tweets per measured epoch")
+
+  ap.add_argument("--epochs",
+                  type=int,
+                  default=10,
+                  help="Epochs per trial, for the hours/trial estimate")
+
+  ap.add_argument("--folds",
+                  type=int,
+                  default=10,
+                  help="Folds per trial, for the hours/trial estimate (1 for run.py)")
+
+  ap.add_argument("--min_efficiency",
+                  type=float,
+                  default=0.5,
+                  help="Suggest the batch sizes with at least this fraction of the best throughput")
+
+  ap.add_argument("--threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow threads (default: $TF_INTRA_OP_THREADS, $SLURM_CPUS_PER_TASK or every core)")
+
+  ap.add_argument("-o",
+                  "--output",
+                  default=None,
+                  help="JSON file to store the measurements")
+
+  args = ap.parse_args()
+
+  parallel.configure_threads(args.threads)
+  main(args)
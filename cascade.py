@@ -0,0 +1,206 @@
+# Cascade inference
+# Input parameters (-m expensive model, -l lexicon, -c cheap scorer, -b uncertainty band)
+# A cheap scorer handles every tweet and only the uncertain ones go to the expensive model
+
+import loadembeddings
+import loaddata
+import loadfeatures
+import buildmodel
+import serving
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import random, time
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+
+# Cheap scorer: linear model over the lexicon features
+class LexiconLinearScorer:
+  def __init__(self, lexicon, path='../lexicons/'):
+    self.lexicon = loadfeatures.LEXICONS[lexicon](path=path)
+    self.model = LogisticRegression(class_weight='balanced', max_iter=1000)
+
+  def fit(self, texts, labels):
+    self.model.fit(self.lexicon.process(dataset=loadfeatures.normalize(texts)), labels)
+    return self
+
+  def predict(self, texts):
+    return self.model.predict_proba(self.lexicon.process(dataset=loadfeatures.normalize(texts)))[:, 1]
+
+# Expensive scorer: a Keras model over the tokenized tweets (+ lexicon features)
+class ModelScorer:
+  def __init__(self, model, tokenizer, max_seq, lexicon=None, path='../lexicons/', batch_size=128):
+    self.model = model
+    self.tokenizer = tokenizer
+    self.max_seq = max_seq
+    self.lexicon = loadfeatures.LEXICONS[lexicon](path=path) if lexicon else None
+    self.batch_size = batch_size
+
+  def predict(self, texts):
+    lex = None
+    if self.lexicon is not None:
+      lex = self.lexicon.process(dataset=loadfeatures.normalize(texts))
+    x = loaddata.model_inputs(loaddata.to_sequences(self.tokenizer, texts, self.max_seq), lex)
+    return self.model.predict(x, batch_size=self.batch_size, verbose=0).ravel()
+
+# Two-stage cascade: tweets whose cheap probability falls inside [low, high] are escalated
+class Cascade:
+  def __init__(self, cheap, expensive, low=0.2, high=0.8):
+    self.cheap = cheap
+    self.expensive = expensive
+    self.low = low
+    self.high = high
+
+  # Returns: the probabilities and the mask of escalated tweets
+  def predict(self, texts):
+    texts = np.asarray(texts, dtype=object)
+    y_prob = np.asarray(self.cheap.predict(texts), dtype='float64')
+
+    escalated = (y_prob >= self.low) & (y_prob <= self.high)
+    if escalated.any():
+      y_prob[escalated] = self.expensive.predict(texts[escalated])
+
+    return y_prob, escalated
+
+def main(args):
+  # Data loading
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(args.dataset)
+
+  # A few tweets are enough to know the number of emotions of the lexicon
+  lex_sample, = loaddata.load_lexicon(args.lexicon, [x_train[:10]])
+
+  # Same tokenizer as the expensive model's search
+  max_seq = loaddata.MAX_SEQ
+  tokenizer = loaddata.fit_tokenizer(x_train)
+  word_index = tokenizer.word_index
+  vocab_size = len(word_index) + 1
+
+  # Load embeddings
+  path = '../embeddings/embeddings-l-model.vec'
+  EMB_DIM = 300
+  LIMIT = 100000
+  embedding_matrix = loadembeddings.load_suc(path, word_index, EMB_DIM, LIMIT)
+
+  # Expensive model
+  num_emotions = len(lex_sample.columns) if args.lexicon else None
+  hypermodel = buildmodel.get_hypermodel(args.model, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions)
+  project_name = args.project or args.model + "_" + str(args.lexicon)
+  model = buildmodel.load_best_model(hypermodel, args.directory, project_name, args.objective)
+  expensive = ModelScorer(model, tokenizer, max_seq, args.lexicon, batch_size=args.batch_size)
+
+  # Cheap scorer
+  if args.cheap == 'linear':
+    cheap = LexiconLinearScorer(args.cheap_lexicon).fit(x_train, y_train)
+  else:
+    cheap = serving.Scorer(args.artifact)
+
+  cascade = Cascade(cheap, expensive, args.band[0], args.band[1])
+  texts = np.asarray(x_test, dtype=object)
+
+  # Warm up both models
+  expensive.predict(texts[:args.batch_size])
+  cheap.predict(texts[:args.batch_size])
+
+  start = time.perf_counter()
+  full_prob = expensive.predict(texts)
+  full_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  cascade_prob, escalated = cascade.predict(texts)
+  cascade_time = time.perf_counter() - start
+
+  full_pred = (full_prob > 0.5).astype(int)
+  cascade_pred = (cascade_prob > 0.5).astype(int)
+
+  print("----------------------------------------------")
+  print(f"Cascade report (test set, band [{args.band[0]}, {args.band[1]}]):")
+  print(f"> Escalated: {np.mean(escalated):.4f} ({int(escalated.sum())} of {len(texts)} tweets)")
+  print(f"> {args.model}-only throughput: {len(texts) / full_time:.1f} tweets/s")
+  print(f"> Cascade throughput: {len(texts) / cascade_time:.1f} tweets/s")
+  print(f"> Throughput gain: {full_time / cascade_time:.2f}x")
+  print(f"> Agreement with {args.model}-only: {np.mean(full_pred == cascade_pred):.4f}")
+  print(f"> {args.model}-only F1 macro: {f1_score(y_test, full_pred, average='macro'):.4f}")
+  print(f"> Cascade F1 macro: {f1_score(y_test, cascade_pred, average='macro'):.4f}")
+  print("----------------------------------------------")
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-m",
+                  "--model",
+                  choices=list(buildmodel.MODELS),
+                  default='lstm',
+                  help="Expensive model")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=list(loadfeatures.LEXICONS),
+                  default=None,
+                  help="Name of the lexicon infused in the expensive model")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset the expensive model was trained with")
+
+  ap.add_argument("--directory",
+                  default='../hp_trials/',
+                  help="Directory of the expensive model's search")
+
+  ap.add_argument("-p",
+                  "--project",
+                  default=None,
+                  help="Project name of the expensive model's search (default: model_lexicon)")
+
+  ap.add_argument("--objective",
+                  default='val_accuracy',
+                  help="Objective of the expensive model's search ('accuracy' for run_cv.py)")
+
+  ap.add_argument("-c",
+                  "--cheap",
+                  choices=['linear', 'artifact'],
+                  default='linear',
+                  help="Cheap scorer: linear model over a lexicon or an exported artifact")
+
+  ap.add_argument("--cheap_lexicon",
+                  choices=list(loadfeatures.LEXICONS),
+                  default='sel',
+                  help="Lexicon of the linear cheap scorer")
+
+  ap.add_argument("-a",
+                  "--artifact",
+                  default=None,
+                  help="Exported artifact used as cheap scorer (e.g. a bow model or a student)")
+
+  ap.add_argument("-b",
+                  "--band",
+                  type=float,
+                  nargs=2,
+                  default=[0.2, 0.8],
+                  help="Cheap probabilities inside this band are escalated to the expensive model")
+
+  ap.add_argument("--batch_size",
+                  type=int,
+                  default=128,
+                  help="Scoring batch size")
+
+  args = ap.parse_args()
+
+  if args.cheap == 'artifact' and not args.artifact:
+    ap.error("--cheap artifact needs -a/--artifact")
+
+  main(args)
@@ -0,0 +1,186 @@
+import itertools
+
+import numpy as np
+import tensorflow as tf
+import kerastuner as kt
+
+from tensorflow.keras import layers
+from kerastuner.engine import hyperparameters as hp_module
+
+# Activations are float32
+BYTES = 4
+
+# Gate blocks computed per step by each recurrent layer
+GATES = {layers.LSTM: 4, layers.GRU: 3, layers.SimpleRNN: 1}
+
+# Static cost of a built (untrained) model, per tweet:
+# params, trainable params, FLOPs of one forward pass (a multiply-add counts as 2)
+# and bytes of the activations kept for backpropagation
+def model_cost(model):
+    flops = 0
+    activations = 0
+    for layer in model.layers:
+        flops += layer_flops(layer)
+        activations += layer_activations(layer)
+
+    return {
+        'params': int(model.count_params()),
+        'trainable_params': int(sum(np.prod(w.shape) for w in model.trainable_weights)),
+        'flops': int(flops),
+        'activation_bytes': int(activations * BYTES)
+    }
+
+# Forward FLOPs per tweet of one layer, from its configuration and shapes
+# Lookups (embeddings), dropout (identity at inference) and concatenations are free
+def layer_flops(layer):
+    if isinstance(layer, layers.Bidirectional):
+        return 2 * _recurrent_flops(layer.forward_layer, layer.input_shape)
+    if isinstance(layer, tuple(GATES)):
+        return _recurrent_flops(layer, layer.input_shape)
+    if isinstance(layer, layers.Conv1D):
+        steps, filters = layer.output_shape[1:]
+        return 2 * steps * filters * layer.kernel_size[0] * layer.input_shape[-1]
+    if isinstance(layer, layers.Dense):
+        return 2 * _size(layer.input_shape) * layer.units
+    if isinstance(layer, (layers.GlobalAveragePooling1D, layers.GlobalMaxPool1D)):
+        return _size(layer.input_shape)
+    return 0
+
+# Activation elements per tweet of one layer: its output plus, for recurrent layers,
+# the gates and hidden state of every step
+def layer_activations(layer):
+    elements = _size(layer.output_shape)
+    recurrent = layer.forward_layer if isinstance(layer, layers.Bidirectional) else layer
+    if isinstance(recurrent, tuple(GATES)):
+        directions = 2 if recurrent is not layer else 1
+        elements += directions * layer.input_shape[1] * recurrent.units * (_gates(recurrent) + 1)
+    return elements
+
+# Hyperparameters registered by a HyperModel (building it once with the defaults)
+def search_space(hypermodel):
+    hp = kt.HyperParameters()
+    hypermodel.build(hp)
+    tf.keras.backend.clear_session()
+    return hp.space
+
+# Every value a hyperparameter can take (Floats without step: both ends of the range)
+def hp_values(p):
+    if isinstance(p, hp_module.Choice):
+        return list(p.values)
+    if isinstance(p, hp_module.Int):
+        return list(range(p.min_value, p.max_value + 1, p.step or 1))
+    if isinstance(p, hp_module.Float):
+        if p.step:
+            return list(np.arange(p.min_value, p.max_value + p.step / 2, p.step))
+        return [p.min_value, p.max_value]
+    if isinstance(p, hp_module.Boolean):
+        return [False, True]
+    return [p.value]
+
+# Static cost of a configuration (dict of hyperparameter values), building its model
+def config_cost(hypermodel, values):
+    hp = kt.HyperParameters()
+    hp.values.update(values)
+    cost = model_cost(hypermodel.build(hp))
+    tf.keras.backend.clear_session()
+    return cost
+
+# Static cost of every configuration of the search space
+# Only the hyperparameters that change the cost of the default configuration (units,
+# filters, pooling...) are built, the others (rates, activations, learning rate) share it,
+# so the models built are the distinct architectures instead of the whole grid
+# Returns: the structural hyperparameter names and a list of (values, cost) per configuration
+def space_costs(hypermodel):
+    space = search_space(hypermodel)
+    default = {p.name: p.default for p in space}
+    base = config_cost(hypermodel, default)
+
+    structural = [p.name for p in space
+                  if any(config_cost(hypermodel, dict(default, **{p.name: v})) != base
+                         for v in hp_values(p) if v != p.default)]
+
+    costs = {}
+    results = []
+    for combination in itertools.product(*[hp_values(p) for p in space]):
+        values = dict(zip([p.name for p in space], combination))
+        key = tuple(values[name] for name in structural)
+        if key not in costs:
+            costs[key] = config_cost(hypermodel, values)
+        results.append((values, costs[key]))
+
+    return structural, results
+
+# Names of the cost entries over their limit (None or 0 is no limit)
+def over_budget(cost, budget):
+    return [name for name, limit in budget.items() if limit and cost[name] > limit]
+
+# Score reported to the oracle for a configuration over the budget (never trained): a failed
+# observation, no better than any trained one, so the search learns to avoid its region
+# Objectives bounded by [0, 1] (accuracy, F1...) get the bound, others the worst score seen
+def worst_score(direction, scores=()):
+    if direction == 'max':
+        return min([0.0] + list(scores))
+    return max([1.0] + list(scores))
+
+# Oracle that only proposes configurations within a static budget (FLOPs per tweet and
+# trainable parameters, see over_budget): over-budget candidates are resampled before they
+# become trials, so max_trials only counts trained configurations
+# Gives up (the search stops) after `max_resamples` over-budget candidates in a row
+class BudgetOracle:
+    def __init__(self, *args, hypermodel=None, max_flops=None, max_params=None, max_resamples=100, **kwargs):
+        super(BudgetOracle, self).__init__(*args, **kwargs)
+        self.hypermodel = hypermodel
+        self.budget = {'flops': max_flops, 'trainable_params': max_params}
+        self.max_resamples = max_resamples
+
+    def _within_budget(self, values):
+        if self.hypermodel is None or not any(self.budget.values()):
+            return True
+        over = over_budget(config_cost(self.hypermodel, values), self.budget)
+        if over:
+            print(f"Configuration over the budget ({', '.join(over)}), resampled")
+        return not over
+
+    # First candidate of `sample` (returns the values, None if the space is exhausted)
+    # within the budget, None if there is none
+    def _sample_within_budget(self, sample):
+        for _ in range(self.max_resamples):
+            values = sample()
+            if values is None or self._within_budget(values):
+                return values
+        print(f"No configuration within the budget in {self.max_resamples} candidates, stopping the search")
+        return None
+
+class BudgetRandomSearch(BudgetOracle, kt.oracles.RandomSearch):
+    def _populate_space(self, trial_id):
+        values = self._sample_within_budget(
+            lambda: super(BudgetRandomSearch, self)._populate_space(trial_id)['values'])
+        return {'status': 'RUNNING' if values else 'STOPPED', 'values': values}
+
+# The Gaussian process proposal is checked first: if it is over the budget, the trial
+# gets a random configuration within it instead
+class BudgetBayesianOptimization(BudgetOracle, kt.oracles.BayesianOptimization):
+    def _populate_space(self, trial_id):
+        response = super(BudgetBayesianOptimization, self)._populate_space(trial_id)
+        if response['status'] != 'RUNNING' or response['values'] is None or self._within_budget(response['values']):
+            return response
+        values = self._sample_within_budget(self._random_trial)
+        return {'status': 'RUNNING' if values else 'STOPPED', 'values': values}
+
+# Only the first round of a bracket samples configurations, the next rounds continue them
+class BudgetHyperband(BudgetOracle, kt.oracles.Hyperband):
+    def _random_values(self):
+        return self._sample_within_budget(super(BudgetHyperband, self)._random_values)
+
+def _recurrent_flops(layer, input_shape):
+    steps, features = input_shape[1], input_shape[-1]
+    return steps * 2 * _gates(layer) * layer.units * (features + layer.units)
+
+def _gates(layer):
+    return next(gates for cls, gates in GATES.items() if isinstance(layer, cls))
+
+# Elements per tweet of a shape (or list of shapes), without the batch dimension
+def _size(shape):
+    if isinstance(shape, list):
+        return sum(_size(s) for s in shape)
+    return int(np.prod(shape[1:]))
@@ -0,0 +1,197 @@
+import buildmodel
+import evaluate
+import parallel
+import resultcache
+import telemetry
+
+import copy
+import gc
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import tensorflow as tf
+import kerastuner as kt
+
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import StratifiedKFold, StratifiedShuffleSplit
+from tensorflow.keras.callbacks import EarlyStopping
+
+# State of a fold worker process (set once by the pool initializer)
+_worker = {}
+
+# Stratified fold plan: (train, dev) index arrays, computed once per search
+def fold_plan(y, num_folds=10):
+    kfold = StratifiedKFold(n_splits=num_folds, shuffle=False)
+    return [(train, dev) for train, dev in kfold.split(np.zeros(len(y)), y)]
+
+# Stratified inner validation slice of the training rows of a fold, for early stopping
+# Returns: the positions (within those rows) to fit and to validate on
+def inner_split(y, val_split, seed=1):
+    split = StratifiedShuffleSplit(n_splits=1, test_size=val_split, random_state=seed)
+    return next(split.split(np.zeros(len(y)), y))
+
+# Early stopping that always ends with the weights of the best epoch (Keras only restores
+# them when it stops before the last epoch) and records the epochs run and the best one
+class BestEpochStopping(EarlyStopping):
+    def __init__(self, patience=3):
+        super(BestEpochStopping, self).__init__(monitor='val_loss', patience=patience, restore_best_weights=True)
+
+    def on_train_begin(self, logs=None):
+        super(BestEpochStopping, self).on_train_begin(logs)
+        self.epochs_run = 0
+        self.best_epoch = 0
+
+    def on_epoch_end(self, epoch, logs=None):
+        super(BestEpochStopping, self).on_epoch_end(epoch, logs)
+        self.epochs_run = epoch + 1
+        if self.wait == 0:
+            self.best_epoch = epoch + 1
+
+    def on_train_end(self, logs=None):
+        super(BestEpochStopping, self).on_train_end(logs)
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+# Model inputs as a list of arrays, each one keeps its own dtype (token ids stay integers)
+def as_inputs(x):
+    if not isinstance(x, (list, tuple)):
+        x = [x]
+    return [np.asarray(inp) for inp in x]
+
+# Rows of every input array (a single array for single-input models)
+def take(inputs, index):
+    rows = [inp[index] for inp in inputs]
+    return rows if len(rows) > 1 else rows[0]
+
+# Model of a trial built from a fixed seed in a fresh session: the sequential path and every
+# fold process start from the same initial weights
+def build_model(hypermodel, hp, seed=1):
+    tf.keras.backend.clear_session()
+    gc.collect()
+    tf.random.set_seed(seed)
+    return hypermodel.build(hp)
+
+# Put a built model back to its initial state: stored initial weights and a fresh optimizer
+# (the optimizer slots and iterations are zeroed, as in a newly compiled model)
+def reset_model(model, initial_weights):
+    model.set_weights(initial_weights)
+    for variable in model.optimizer.variables():
+        variable.assign(tf.zeros_like(variable))
+
+# Train and evaluate an already built (or reset) model on one fold
+# With `val_split`, a stratified slice of the training rows stops the training on its loss
+# and the model keeps the weights of its best epoch
+# With `seed`, the random operations of the fold (shuffling, dropout) do not depend on the
+# folds trained before it in the same process
+# Returns: the scores (see evaluate.evaluate_probs, plus the epochs run and the best epoch
+# when stopping early), the dev probabilities, the trained model and the resources used
+# (see telemetry.Meter)
+def train_fold(model, x_train, y_train, x_dev, y_dev, batch_size, fit_kwargs, val_split=0.0, patience=3, seed=None):
+    if seed is not None:
+        tf.random.set_seed(seed)
+
+    meter = telemetry.Meter().start()
+    if not val_split:
+        history = model.fit(x_train, y_train, batch_size=batch_size, **fit_kwargs)
+        stopper = None
+        num_fit = len(y_train)
+    else:
+        fit, val = inner_split(y_train, val_split)
+        inputs = as_inputs(x_train)
+        stopper = BestEpochStopping(patience)
+        fit_kwargs = dict(fit_kwargs, callbacks=list(fit_kwargs.get('callbacks', [])) + [stopper])
+        history = model.fit(take(inputs, fit), y_train[fit], batch_size=batch_size,
+                            validation_data=(take(inputs, val), y_train[val]), **fit_kwargs)
+        num_fit = len(fit)
+    fit_seconds = time.perf_counter() - meter.started
+
+    # One prediction pass for every metric
+    y_prob = model.predict(x_dev, batch_size=128, verbose=0)
+    scores = evaluate.evaluate_probs(y_dev, y_prob)
+    if stopper is not None:
+        scores.update({'epochs': stopper.epochs_run, 'best_epoch': stopper.best_epoch})
+
+    meter.stop()
+    epochs = len(history.epoch)
+    resources = meter.record(fit_seconds=fit_seconds,
+                             predict_seconds=meter.wall_seconds - fit_seconds,
+                             epochs=epochs,
+                             samples_per_sec=num_fit * epochs / fit_seconds)
+
+    return scores, y_prob, model, resources
+
+# Content-addressed store of weight arrays: every array is saved once as <fingerprint>.npy,
+# so the frozen embedding matrix (the same in every fold and trial) is never duplicated
+# Returns: the keys of the arrays, in order
+def save_weights(directory, weights):
+    os.makedirs(directory, exist_ok=True)
+    keys = []
+    for array in weights:
+        key = resultcache.fingerprint(array)
+        fname = os.path.join(directory, key + '.npy')
+        if not os.path.exists(fname):
+            with open(fname + '.' + str(os.getpid()), 'wb') as f:
+                np.save(f, array)
+            os.replace(fname + '.' + str(os.getpid()), fname)
+        keys.append(key)
+    return keys
+
+def load_weights(directory, keys):
+    return [np.load(os.path.join(directory, key + '.npy')) for key in keys]
+
+# Process pool training one fold per task with a bounded number of threads
+# The hypermodel (and its embedding matrix) and the dataset are sent once per worker,
+# every fold only sends its index arrays
+def fold_pool(hypermodel, workers, inputs, y, threads=None, seed=1):
+    threads = threads or max(1, parallel.available_cores() // workers)
+
+    # Keras metrics can not be pickled, every worker creates its own
+    hypermodel = copy.copy(getattr(hypermodel, 'hypermodel', hypermodel))
+    hypermodel.metrics = None
+
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker,
+                               initargs=(hypermodel, inputs, y, threads, seed))
+
+# Train every fold of the plan in the pool
+# Yields: (scores, y_prob, weights, resources) per fold, in fold order
+# Closing the generator cancels the folds that have not started yet
+def run_folds(pool, hp, plan, batch_size, fit_kwargs, val_split=0.0, patience=3):
+    futures = []
+    for train, dev in plan:
+        futures.append(pool.submit(_train_fold_worker, hp.get_config(), train, dev, batch_size, fit_kwargs, val_split, patience))
+
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _init_worker(hypermodel, inputs, y, threads, seed):
+    parallel.configure_threads(threads)
+    hypermodel.metrics = buildmodel.new_metrics()
+    _worker['hypermodel'] = hypermodel
+    _worker['inputs'] = inputs
+    _worker['y'] = y
+    _worker['seed'] = seed
+    _worker['trial'] = None
+
+def _train_fold_worker(hp_config, train, dev, batch_size, fit_kwargs, val_split, patience):
+    # The model is built once per trial in every worker, later folds only reset it
+    trial = json.dumps(hp_config, sort_keys=True)
+    if _worker['trial'] != trial:
+        _worker['model'] = None
+        _worker['model'] = build_model(_worker['hypermodel'], kt.HyperParameters.from_config(hp_config), _worker['seed'])
+        _worker['initial_weights'] = _worker['model'].get_weights()
+        _worker['trial'] = trial
+
+    model = _worker['model']
+    reset_model(model, _worker['initial_weights'])
+
+    inputs, y = _worker['inputs'], _worker['y']
+    scores, y_prob, model, resources = train_fold(model, take(inputs, train), y[train], take(inputs, dev), y[dev], batch_size, fit_kwargs, val_split, patience, _worker['seed'])
+    return scores, y_prob, model.get_weights(), resources
@@ -0,0 +1,188 @@
+# Knowledge distillation
+# Input parameters (-m teacher model, -l lexicon, -u unlabeled tweets, -s student)
+# The teacher is the best model of a finished search in ../hp_trials/
+
+import loadembeddings
+import loaddata
+import loadfeatures
+import buildmodel
+import evaluate
+import export
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import random
+
+from tensorflow.keras.callbacks import EarlyStopping
+from sklearn.metrics import f1_score
+
+def main(args):
+  # Data loading
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(args.dataset)
+  x_unlabeled = loaddata.load_texts(args.unlabeled, args.column)
+  print("Unlabeled tweets: " + str(len(x_unlabeled)))
+
+  # Lexicon loading
+  lex_train, lex_test, lex_unlabeled = loaddata.load_lexicon(args.lexicon, [x_train, x_test, x_unlabeled])
+
+  # Same tokenizer as the teacher's search
+  max_seq = loaddata.MAX_SEQ
+  tokenizer = loaddata.fit_tokenizer(x_train)
+  word_index = tokenizer.word_index
+  vocab_size = len(word_index) + 1
+
+  seq_train = loaddata.to_sequences(tokenizer, x_train, max_seq)
+  seq_test = loaddata.to_sequences(tokenizer, x_test, max_seq)
+  seq_unlabeled = loaddata.to_sequences(tokenizer, x_unlabeled, max_seq)
+
+  # Load embeddings
+  path = '../embeddings/embeddings-l-model.vec'
+  EMB_DIM = 300
+  LIMIT = 100000
+  embedding_matrix = loadembeddings.load_suc(path, word_index, EMB_DIM, LIMIT)
+
+  # Teacher
+  num_emotions = len(lex_train.columns) if args.lexicon else None
+  hypermodel = buildmodel.get_hypermodel(args.model, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions)
+
+  project_name = args.project or args.model + "_" + str(args.lexicon)
+  teacher = buildmodel.load_best_model(hypermodel, args.directory, project_name, args.objective)
+
+  # Soft targets for the training and unlabeled tweets
+  x_soft = loaddata.model_inputs(np.concatenate([seq_train, seq_unlabeled]),
+                                 None if lex_train is None else np.concatenate([lex_train, lex_unlabeled]))
+  print("Labelling with the teacher...")
+  soft_targets = teacher.predict(x_soft, batch_size=args.batch_size, verbose=0).ravel()
+
+  # Mix the gold labels of the training tweets into their soft targets
+  hard = np.asarray(y_train, dtype='float32')
+  soft_targets[:len(hard)] = args.alpha * hard + (1 - args.alpha) * soft_targets[:len(hard)]
+
+  # Student
+  student = buildmodel.build_student(args.student, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions)
+  student.summary()
+
+  callbacks = [
+      EarlyStopping(monitor='val_loss', verbose=1, patience=3, restore_best_weights=True)
+  ]
+  student.fit(x_soft, soft_targets, validation_split=0.1, shuffle=True, epochs=args.epochs,
+              batch_size=args.batch_size, callbacks=callbacks, verbose=2)
+
+  # Agreement on the test set
+  x_eval = loaddata.model_inputs(seq_test, lex_test)
+  teacher_prob = teacher.predict(x_eval, batch_size=args.batch_size, verbose=0).ravel()
+  student_prob = student.predict(x_eval, batch_size=args.batch_size, verbose=0).ravel()
+  teacher_pred = (teacher_prob > 0.5).astype(int)
+  student_pred = (student_prob > 0.5).astype(int)
+
+  teacher_batch, teacher_single = evaluate.time_inference(teacher, x_eval, args.batch_size)
+  student_batch, student_single = evaluate.time_inference(student, x_eval, args.batch_size)
+
+  print("----------------------------------------------")
+  print("Student/teacher report (test set):")
+  print(f"> Agreement: {np.mean(teacher_pred == student_pred):.4f}")
+  print(f"> Mean absolute probability gap: {np.mean(np.abs(teacher_prob - student_prob)):.4f}")
+  print(f"> Teacher F1 macro: {f1_score(y_test, teacher_pred, average='macro'):.4f}")
+  print(f"> Student F1 macro: {f1_score(y_test, student_pred, average='macro'):.4f}")
+  print(f"> Teacher params: {teacher.count_params()} / student params: {student.count_params()}")
+  print(f"> Batched speedup: {teacher_batch / student_batch:.2f}x ({student_batch * 1e6:.1f} us/tweet)")
+  print(f"> Single-tweet speedup: {teacher_single / student_single:.2f}x ({student_single * 1e3:.2f} ms/tweet)")
+  print("----------------------------------------------")
+
+  # Standalone serving artifact for the student
+  if args.export:
+    representative_data = seq_train if lex_train is None else [seq_train, lex_train.to_numpy()]
+    export.export_artifact(student, tokenizer, max_seq, args.lexicon, args.export, args.quantize, representative_data)
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-m",
+                  "--model",
+                  choices=list(buildmodel.MODELS),
+                  default='lstm',
+                  help="Teacher model")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=list(loadfeatures.LEXICONS),
+                  default=None,
+                  help="Name of the lexicon infused in the teacher")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset the teacher was trained with")
+
+  ap.add_argument("--directory",
+                  default='../hp_trials/',
+                  help="Directory of the teacher's search")
+
+  ap.add_argument("-p",
+                  "--project",
+                  default=None,
+                  help="Project name of the teacher's search (default: model_lexicon)")
+
+  ap.add_argument("--objective",
+                  default='val_accuracy',
+                  help="Objective of the teacher's search ('accuracy' for run_cv.py)")
+
+  ap.add_argument("-u",
+                  "--unlabeled",
+                  nargs='+',
+                  required=True,
+                  help="TSV files with unlabeled tweets")
+
+  ap.add_argument("-c",
+                  "--column",
+                  default='text',
+                  help="Column with the tweets' text in the unlabeled files")
+
+  ap.add_argument("-s",
+                  "--student",
+                  choices=['cnn', 'mlp'],
+                  default='cnn',
+                  help="Student model")
+
+  ap.add_argument("-a",
+                  "--alpha",
+                  type=float,
+                  default=0.0,
+                  help="Weight of the gold labels in the training tweets' targets")
+
+  ap.add_argument("--epochs",
+                  type=int,
+                  default=10,
+                  help="Student training epochs")
+
+  ap.add_argument("--batch_size",
+                  type=int,
+                  default=128,
+                  help="Batch size")
+
+  ap.add_argument("-e",
+                  "--export",
+                  default=None,
+                  help="Directory to export the student as a serving artifact")
+
+  ap.add_argument("-q",
+                  "--quantize",
+                  choices=['none', 'dynamic', 'int8'],
+                  default='dynamic',
+                  help="TFLite quantization of the exported student")
+
+  args = ap.parse_args()
+  main(args)
@@ -0,0 +1,232 @@
+# Shared-embedding ensemble
+# Input parameters (-r trial directories, -m models, -c combination)
+# Merges several trained models into one graph with a single embedding lookup
+
+import loadembeddings
+import loaddata
+import loadfeatures
+import buildmodel
+import export
+
+import argparse
+import os
+import numpy as np
+import tensorflow as tf
+import random, time
+
+from tensorflow import keras
+from tensorflow.keras import layers
+from sklearn.metrics import f1_score
+
+# Merge trained models into one graph that gathers the embeddings once
+# combine: 'mean' (average of probabilities) or 'stack' (trainable logistic layer on top)
+def build_ensemble(models, combine='mean', embedding_name='Embedding'):
+  embeddings = [m.get_layer(embedding_name) for m in models]
+  reference = embeddings[0].get_weights()[0]
+  for embedding in embeddings[1:]:
+    if not np.array_equal(embedding.get_weights()[0], reference):
+      raise ValueError("Every model must share the same embedding matrix (same tokenizer and embeddings)")
+
+  # The heads get the lookup of the first model: its mask (e.g. bow masks the padding,
+  # the recurrent and convolutional models do not), length and dtype must be theirs too
+  for name in ('mask_zero', 'input_length', 'dtype'):
+    settings = [getattr(embedding, name) for embedding in embeddings]
+    if any(setting != settings[0] for setting in settings[1:]):
+      raise ValueError("Every model must use the same embedding " + name + ", found " +
+                       ", ".join(m.name + ": " + str(setting) for m, setting in zip(models, settings)))
+
+  # Inputs of the first model: token ids and, optionally, the lexicon features
+  first = models[0]
+  token_input = embeddings[0].get_input_at(0)
+  inputs = [keras.Input(shape=token_input.shape[1:], dtype=token_input.dtype, name='Input_A')]
+  features = [i for i in first.inputs if i is not token_input]
+  if features:
+    inputs.append(keras.Input(shape=features[0].shape[1:], name='Input_B'))
+
+  # Single embedding lookup
+  embedded = embeddings[0](inputs[0])
+
+  outputs = []
+  for index, model in enumerate(models):
+    outputs.append(_apply_head(model, embeddings[index], embedded, inputs[1:], 'm' + str(index) + '_'))
+
+  if combine == 'mean':
+    x = layers.Average(name='Ensemble_Average')(outputs)
+  elif combine == 'stack':
+    # Only the stacking layer is trained
+    for model in models:
+      model.trainable = False
+    x = layers.Concatenate(name='Ensemble_Heads')(outputs)
+    x = layers.Dense(1, activation='sigmoid', name='Ensemble_Stacker')(x)
+  else:
+    raise ValueError("Unknown combination: " + str(combine))
+
+  ensemble = keras.Model(inputs=inputs if len(inputs) > 1 else inputs[0], outputs=x, name='ensemble')
+  ensemble.compile(loss='binary_crossentropy',
+                   optimizer=keras.optimizers.Adam(1e-2),
+                   metrics=[keras.metrics.BinaryAccuracy(name='accuracy')])
+
+  return ensemble
+
+# Replay every layer after the embedding of a trained model over the shared embedded tensor
+# The layers (and therefore their trained weights) are reused, not copied
+def _apply_head(model, embedding, embedded, features, prefix):
+  # Node 0 of every layer belongs to the trained model, the ensemble adds a new node
+  tensors = {embedding.get_output_at(0).ref(): embedded}
+  for inp in model.inputs:
+    if inp is not embedding.get_input_at(0):
+      tensors[inp.ref()] = features[0]
+
+  for layer in model.layers:
+    if isinstance(layer, layers.InputLayer) or layer is embedding:
+      continue
+
+    # Layer names must be unique inside the ensemble
+    layer._name = prefix + layer.name
+    inbound = tf.nest.map_structure(lambda t: tensors[t.ref()], layer.get_input_at(0))
+    tensors[layer.get_output_at(0).ref()] = layer(inbound)
+
+  return tensors[model.output.ref()]
+
+# Seconds to score the whole set
+def time_predict(model, x, batch_size=128):
+  model.predict(x, batch_size=batch_size, verbose=0)    # Warm up
+  start = time.perf_counter()
+  model.predict(x, batch_size=batch_size, verbose=0)
+  return time.perf_counter() - start
+
+def main(args):
+  if len(args.models) != len(args.runs):
+    print("Give one model (-m) per trial directory (-r).")
+    exit()
+
+  # Data loading
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(args.dataset)
+  lex_train, lex_test = loaddata.load_lexicon(args.lexicon, [x_train, x_test])
+
+  # Same tokenizer as the searches
+  max_seq = loaddata.MAX_SEQ
+  tokenizer = loaddata.fit_tokenizer(x_train)
+  word_index = tokenizer.word_index
+  vocab_size = len(word_index) + 1
+  seq_train = loaddata.to_sequences(tokenizer, x_train, max_seq)
+  seq_test = loaddata.to_sequences(tokenizer, x_test, max_seq)
+
+  # Load embeddings
+  path = '../embeddings/embeddings-l-model.vec'
+  EMB_DIM = 300
+  LIMIT = 100000
+  embedding_matrix = loadembeddings.load_suc(path, word_index, EMB_DIM, LIMIT)
+
+  # Best model of every run
+  num_emotions = len(lex_train.columns) if args.lexicon else None
+  members = []
+  for name, run in zip(args.models, args.runs):
+    hypermodel = buildmodel.get_hypermodel(name, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions)
+    run = run.rstrip('/')
+    members.append(buildmodel.load_best_model(hypermodel, os.path.dirname(run), os.path.basename(run), args.objective))
+
+  x_eval = loaddata.model_inputs(seq_test, lex_test)
+  members_prob = [m.predict(x_eval, batch_size=args.batch_size, verbose=0).ravel() for m in members]
+  members_time = sum(time_predict(m, x_eval, args.batch_size) for m in members)
+  members_params = sum(m.count_params() for m in members)
+
+  ensemble = build_ensemble(members, args.combine)
+  ensemble.summary()
+
+  # The stacker is fitted on the last 20% of the training set (the search's validation split)
+  if args.combine == 'stack':
+    split = int(len(seq_train) * 0.8)
+    x_stack = loaddata.model_inputs(seq_train[split:], None if lex_train is None else lex_train[split:])
+    ensemble.fit(x_stack, np.asarray(y_train)[split:], epochs=args.epochs, batch_size=args.batch_size, verbose=2)
+
+  y_prob = ensemble.predict(x_eval, batch_size=args.batch_size, verbose=0).ravel()
+  ensemble_time = time_predict(ensemble, x_eval, args.batch_size)
+
+  print("----------------------------------------------")
+  print("Ensemble report (test set):")
+  for name, prob in zip(args.models, members_prob):
+    print(f"> {name} F1 macro: {f1_score(y_test, (prob > 0.5).astype(int), average='macro'):.4f}")
+  print(f"> Ensemble F1 macro: {f1_score(y_test, (y_prob > 0.5).astype(int), average='macro'):.4f}")
+  print(f"> Separate models: {members_time:.2f}s, {members_params} params")
+  print(f"> Shared-embedding ensemble: {ensemble_time:.2f}s, {ensemble.count_params()} params")
+  print(f"> Speedup: {members_time / ensemble_time:.2f}x")
+  print("----------------------------------------------")
+
+  # Standalone serving artifact
+  if args.export:
+    representative_data = seq_train if lex_train is None else [seq_train, lex_train.to_numpy()]
+    export.export_artifact(ensemble, tokenizer, max_seq, args.lexicon, args.export, args.quantize, representative_data)
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-r",
+                  "--runs",
+                  nargs='+',
+                  required=True,
+                  help="Trial directories of the searches (e.g. ../hp_trials/lstm_None)")
+
+  ap.add_argument("-m",
+                  "--models",
+                  nargs='+',
+                  choices=list(buildmodel.MODELS),
+                  required=True,
+                  help="Model of each search, in the same order")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=list(loadfeatures.LEXICONS),
+                  default=None,
+                  help="Name of the lexicon infused in the models")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset the models were trained with")
+
+  ap.add_argument("--objective",
+                  default='val_accuracy',
+                  help="Objective of the searches ('accuracy' for run_cv.py)")
+
+  ap.add_argument("-c",
+                  "--combine",
+                  choices=['mean', 'stack'],
+                  default='mean',
+                  help="Average the probabilities or stack them with a logistic layer")
+
+  ap.add_argument("--epochs",
+                  type=int,
+                  default=10,
+                  help="Training epochs of the stacker")
+
+  ap.add_argument("--batch_size",
+                  type=int,
+                  default=128,
+                  help="Batch size")
+
+  ap.add_argument("-e",
+                  "--export",
+                  default=None,
+                  help="Directory to export the ensemble as a serving artifact")
+
+  ap.add_argument("-q",
+                  "--quantize",
+                  choices=['none', 'dynamic', 'int8'],
+                  default='dynamic',
+                  help="TFLite quantization of the exported ensemble")
+
+  args = ap.parse_args()
+  main(args)
@@ -0,0 +1,153 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from scipy.stats import rankdata
+
+# Same clipping as Keras' binary crossentropy
+EPSILON = 1e-7
+
+# Every evaluation metric from one prediction pass (vectorized over the probabilities)
+# Returns: loss, accuracy, precision, recall and auc as in buildmodel.METRICS,
+# plus the macro precision, recall and f1 of both classes
+def evaluate_probs(y_true, y_prob, threshold=0.5):
+    y_true = np.asarray(y_true, dtype='float64').ravel()
+    y_prob = np.asarray(y_prob, dtype='float64').ravel()
+
+    # Binary crossentropy
+    clipped = np.clip(y_prob, EPSILON, 1 - EPSILON)
+    loss = -np.mean(y_true * np.log(clipped) + (1 - y_true) * np.log(1 - clipped))
+
+    # Confusion matrix
+    y_pred = y_prob > threshold
+    positive = y_true == 1
+    tp = np.sum(y_pred & positive)
+    fp = np.sum(y_pred & ~positive)
+    fn = np.sum(~y_pred & positive)
+    tn = np.sum(~y_pred & ~positive)
+
+    # Per class scores: positive class first, negative class second
+    precision = np.array([_divide(tp, tp + fp), _divide(tn, tn + fn)])
+    recall = np.array([_divide(tp, tp + fn), _divide(tn, tn + fp)])
+    f1 = np.array([_divide(2 * p * r, p + r) for p, r in zip(precision, recall)])
+
+    return {
+        'loss': float(loss),
+        'accuracy': _divide(tp + tn, len(y_true)),
+        'precision': float(precision[0]),
+        'recall': float(recall[0]),
+        'auc': roc_auc(y_true, y_prob),
+        'precision_macro': float(np.mean(precision)),
+        'recall_macro': float(np.mean(recall)),
+        'f1_macro': float(np.mean(f1))
+    }
+
+# Exact ROC AUC from the ranks of the probabilities (Mann-Whitney U, ties averaged)
+def roc_auc(y_true, y_prob):
+    positive = np.asarray(y_true).ravel() == 1
+    num_pos = np.sum(positive)
+    num_neg = len(positive) - num_pos
+    if num_pos == 0 or num_neg == 0:
+        return 0.0
+
+    ranks = rankdata(np.asarray(y_prob).ravel())
+    return float((np.sum(ranks[positive]) - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg))
+
+# Decision threshold maximizing the macro F1 (tweets with y_prob > threshold are positive)
+# Sorts the probabilities once and scores every cut with cumulative counts: O(n log n)
+# Returns: the threshold and its macro F1
+def best_threshold(y_true, y_prob):
+    y_true = np.asarray(y_true, dtype='float64').ravel()
+    y_prob = np.asarray(y_prob, dtype='float64').ravel()
+
+    order = np.argsort(-y_prob, kind='mergesort')
+    probs = y_prob[order]
+    labels = y_true[order]
+
+    # Cut i predicts the i most probable tweets as positive (i = 0..n)
+    tp = np.concatenate([[0.0], np.cumsum(labels)])
+    fp = np.concatenate([[0.0], np.cumsum(1 - labels)])
+    fn = tp[-1] - tp
+    tn = fp[-1] - fp
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1_pos = np.nan_to_num(2 * tp / (2 * tp + fp + fn))
+        f1_neg = np.nan_to_num(2 * tn / (2 * tn + fn + fp))
+    f1_macro = (f1_pos + f1_neg) / 2
+
+    # A cut can not separate tweets with the same probability
+    valid = np.ones(len(probs) + 1, dtype=bool)
+    valid[1:-1] = probs[:-1] > probs[1:]
+    best = int(np.argmax(np.where(valid, f1_macro, -1)))
+
+    # Threshold halfway between both sides of the cut
+    if best == 0:
+        threshold = probs[0]
+    elif best == len(probs):
+        threshold = np.nextafter(probs[-1], -np.inf)
+    else:
+        threshold = (probs[best - 1] + probs[best]) / 2
+
+    return float(threshold), float(f1_macro[best])
+
+# Seconds per tweet for batched and single-tweet inference
+def time_inference(model, x, batch_size=128, single_runs=100):
+    inputs = x if isinstance(x, list) else [x]
+    model.predict(x, batch_size=batch_size, verbose=0)    # Warm up
+
+    start = time.perf_counter()
+    model.predict(x, batch_size=batch_size, verbose=0)
+    batch_time = (time.perf_counter() - start) / len(inputs[0])
+
+    single = [inp[:1] for inp in inputs]
+    single = single if len(single) > 1 else single[0]
+    model(single, training=False)
+
+    start = time.perf_counter()
+    for _ in range(single_runs):
+        model(single, training=False)
+    single_time = (time.perf_counter() - start) / single_runs
+
+    return batch_time, single_time
+
+# Serving cost of a model: parameters and inference latency in milliseconds
+# (does not depend on the trained weights, it can be measured before training)
+def serving_cost(model, x, batch_size=128, single_runs=50):
+    batch_time, single_time = time_inference(model, x, batch_size, single_runs)
+    return {
+        'params': int(model.count_params()),
+        'latency_ms': single_time * 1000,
+        'batch_latency_ms': batch_time * 1000
+    }
+
+# Serving cost stored in a trial directory, None if it was not measured
+COST_FILE = 'cost.json'
+
+def save_cost(trial_dir, cost):
+    with open(os.path.join(trial_dir, COST_FILE), 'w') as f:
+        json.dump(cost, f)
+
+def load_cost(trial_dir):
+    if not os.path.exists(os.path.join(trial_dir, COST_FILE)):
+        return None
+    with open(os.path.join(trial_dir, COST_FILE)) as f:
+        return json.load(f)
+
+# Indices of the Pareto-optimal points (higher score, lower cost): no other point is at
+# least as good in both and better in one. Sorted by cost, O(n log n)
+def pareto_front(scores, costs):
+    scores = np.asarray(scores, dtype='float64')
+    costs = np.asarray(costs, dtype='float64')
+
+    front = []
+    best = -np.inf
+    for i in np.lexsort((-scores, costs)):
+        if scores[i] > best:
+            front.append(int(i))
+            best = scores[i]
+    return front
+
+def _divide(numerator, denominator):
+    return float(numerator) / denominator if denominator else 0.0
@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+# Artifact layout
+SAVED_MODEL_DIR = 'saved_model'
+TFLITE_FILE = 'model.tflite'
+TOKENIZER_FILE = 'tokenizer.json'
+METADATA_FILE = 'metadata.json'
+
+# Export a trained model as a standalone serving artifact
+# (SavedModel + TFLite flatbuffer + tokenizer + metadata)
+def export_artifact(model, tokenizer, max_seq, lexicon, out_dir, quantization='dynamic', representative_data=None, num_samples=200, threshold=0.5):
+    os.makedirs(out_dir, exist_ok=True)
+
+    # SavedModel without the optimizer state, it is only used for inference
+    model.save(os.path.join(out_dir, SAVED_MODEL_DIR), include_optimizer=False, save_format='tf')
+
+    # TFLite flatbuffer
+    tflite_model = convert_tflite(model, quantization, representative_data, num_samples)
+    with open(os.path.join(out_dir, TFLITE_FILE), 'wb') as f:
+        f.write(tflite_model)
+
+    # Tokenizer vocabulary (word_index, num_words, filters...)
+    with open(os.path.join(out_dir, TOKENIZER_FILE), 'w', encoding='utf8') as f:
+        f.write(tokenizer.to_json())
+
+    metadata = {
+        'max_seq': int(max_seq),
+        'lexicon': lexicon,
+        'quantization': quantization,
+        'threshold': float(threshold),
+        'inputs': [str(i.name) for i in model.inputs]
+    }
+    with open(os.path.join(out_dir, METADATA_FILE), 'w', encoding='utf8') as f:
+        json.dump(metadata, f, indent=2)
+
+    print("Artifact exported to " + out_dir)
+    return metadata
+
+# Convert a Keras model to TFLite
+# quantization: 'none', 'dynamic' (int8 weights) or 'int8' (int8 weights and activations)
+def convert_tflite(model, quantization='dynamic', representative_data=None, num_samples=200):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    # Recurrent layers and the float64 token input may need TF kernels
+    ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+    if quantization == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == 'int8':
+        if representative_data is None:
+            raise ValueError("Full int8 quantization needs representative data")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = _representative_dataset(model, representative_data, num_samples)
+        ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.SELECT_TF_OPS]
+    elif quantization != 'none':
+        raise ValueError("Unknown quantization: " + str(quantization))
+
+    converter.target_spec.supported_ops = ops
+    return converter.convert()
+
+# Calibration samples for full int8 quantization, one tweet at a time
+def _representative_dataset(model, data, num_samples):
+    if not isinstance(data, (list, tuple)):
+        data = [data]
+    data = [np.asarray(x) for x in data]
+    dtypes = [i.dtype.as_numpy_dtype for i in model.inputs]
+    num_samples = min(num_samples, len(data[0]))
+
+    def generator():
+        for i in range(num_samples):
+            yield [x[i:i + 1].astype(dtype) for x, dtype in zip(data, dtypes)]
+
+    return generator
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import loadfeatures
+
+from tensorflow.keras import preprocessing
+
+# Datasets: folder, train file, test file, text column, label column
+DATASETS = {
+  'hateval': ('HatEval/', 'train.tsv', 'test.tsv', 3, 1),
+  'haternet': ('HaterNet/', 'train_prep_uncased.tsv', 'test_prep_uncased.tsv', 'text', 'label')
+}
+
+# Tokenizer defaults
+MAX_WORDS = 10000   # Top most frequent words
+MAX_SEQ = 75        # Size to be padded to (should be greater than the max value=70)
+
+# Load the train and test splits of a dataset
+# Returns: x_train, y_train, x_test, y_test
+def load_dataset(name, path='../data/'):
+  folder, train_file, test_file, text, label = DATASETS[name]
+
+  training_set = pd.read_csv(path + folder + train_file, sep='\t')
+  test_set = pd.read_csv(path + folder + test_file, sep='\t')
+
+  return (_column(training_set, text), _column(training_set, label),
+          _column(test_set, text), _column(test_set, label))
+
+# Load the tweets of an unlabeled dump (one tweet per row)
+def load_texts(files, column='text'):
+  if isinstance(files, str):
+    files = [files]
+
+  texts = [pd.read_csv(file, sep='\t', usecols=[column])[column] for file in files]
+  return pd.concat(texts, ignore_index=True).dropna().astype(str)
+
+# Lexicon features for every dataset given
+# Returns: a list of dataframes (one per dataset), or Nones if there is no lexicon
+def load_lexicon(name, datasets, path='../lexicons/'):
+  if not name:
+    print("No se utilizará lexicon.")
+    return [None for dataset in datasets]
+
+  lexicon = loadfeatures.LEXICONS[name](path=path)
+  return [lexicon.process(dataset=loadfeatures.normalize(dataset)) for dataset in datasets]
+
+# Create a tokenizer that takes the most common words of the training tweets
+def fit_tokenizer(texts, max_words=MAX_WORDS):
+  tokenizer = preprocessing.text.Tokenizer(num_words=max_words)
+  tokenizer.fit_on_texts(texts)
+  return tokenizer
+
+# Transform each tweet into a numerical sequence padded with zeros until max_seq
+def to_sequences(tokenizer, texts, max_seq=MAX_SEQ):
+  sequences = tokenizer.texts_to_sequences(texts)
+  return preprocessing.sequence.pad_sequences(sequences, maxlen=max_seq)
+
+# Model inputs: token ids alone or token ids plus lexicon features
+def model_inputs(sequences, lex=None):
+  if lex is None:
+    return sequences
+  return [sequences, np.asarray(lex)]
+
+def _column(dataset, column):
+  if isinstance(column, int):
+    return dataset.iloc[:, column]
+  return dataset[column]
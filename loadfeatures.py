@@ -231,6 +231,21 @@ class All:
     return result
 
 
+# Lexicon classes by their command line name
+LEXICONS = {
+  'liwc': SpanishLIWC,
+  'sel': SEL,
+  'emolex': Emolex,
+  'isal': iSAL,
+  'all': All
+}
+
+
+# Remove accents so tweets can be matched against the lexicons
+def normalize(dataset):
+  return pd.Series(dataset).str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
+
+
 # Tokenizer function
 def tokenize(text):
   tknzr = TweetTokenizer(preserve_case=False)
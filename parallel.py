@@ -0,0 +1,349 @@
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+# Environment variables of keras-tuner's distributed mode
+TUNER_ID = 'KERASTUNER_TUNER_ID'
+ORACLE_IP = 'KERASTUNER_ORACLE_IP'
+ORACLE_PORT = 'KERASTUNER_ORACLE_PORT'
+
+# Shared-directory mode: every worker runs its own oracle over the project directory
+SHARED = 'KERASTUNER_SHARED_ORACLE'
+
+# Thread configuration of a process (set by launch(), or by hand before running a script)
+INTRA_THREADS = 'TF_INTRA_OP_THREADS'
+INTER_THREADS = 'TF_INTER_OP_THREADS'
+AFFINITY = 'TF_CPU_AFFINITY'
+
+# Seconds after which the lock of a dead worker is broken
+LOCK_TIMEOUT = 120
+
+# Seconds without any file of a running trial changing after which its worker is taken as dead
+TRIAL_TIMEOUT = 3600
+
+# True inside a process of a parallel search (started by launch() or by srun)
+def is_distributed():
+    return ORACLE_IP in os.environ or is_shared()
+
+# True in the shared-directory mode
+def is_shared():
+    return os.environ.get(SHARED) == '1'
+
+# True for the processes that only run trials (not the chief oracle, or not tuner0 in the
+# shared-directory mode)
+def is_worker():
+    if is_shared():
+        return os.environ.get(TUNER_ID) != 'tuner0'
+    return is_distributed() and os.environ.get(TUNER_ID) != 'chief'
+
+# Join a shared-directory search: one worker per SLURM task (tuner<SLURM_PROCID>)
+# Must be called before the tuner is created
+def join_shared():
+    os.environ[SHARED] = '1'
+    os.environ.setdefault(TUNER_ID, 'tuner' + os.environ.get('SLURM_PROCID', '0'))
+
+# Cores available to this process (SLURM/taskset aware)
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Resident memory of this process in bytes: current (VmRSS) or peak (VmHWM)
+def rss(peak=False):
+    key = 'VmHWM:' if peak else 'VmRSS:'
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # Without /proc only the peak is known (KB on Linux)
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Restart the peak resident memory from the current one (Linux only)
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+# Resident memory of a search after every trial, to catch leaks (graphs or weights that
+# are never released). The level after the first trial (TensorFlow and the data already
+# loaded) is the baseline: growing more than `max_growth` bytes over it raises MemoryError.
+# The levels are stored in `fname` (JSON), one file per worker
+class MemoryGuard:
+    def __init__(self, fname=None, max_growth=None):
+        self.fname = fname
+        self.max_growth = max_growth
+        self.levels = []
+
+    def check(self, trial_id):
+        level = rss()
+        self.levels.append({'trial_id': trial_id, 'rss': level, 'peak_rss': rss(peak=True)})
+        growth = level - self.levels[0]['rss']
+        print(f'Memory after trial {trial_id}: {level / 2**20:.0f} MB RSS ({growth / 2**20:+.0f} MB since the first trial)')
+        if self.fname:
+            _write_json(self.fname, self.levels)
+
+        if self.max_growth and growth > self.max_growth:
+            raise MemoryError(f'Resident memory grew {growth / 2**20:.0f} MB in {len(self.levels) - 1} trials '
+                              f'(limit {self.max_growth / 2**20:.0f} MB): models are not being released')
+        return level
+
+# Name of the memory log of this worker in a project directory
+def memory_log(project_dir):
+    return os.path.join(project_dir, 'memory_' + os.environ.get(TUNER_ID, 'tuner0') + '.json')
+
+# Threads of this process: given, $TF_INTRA_OP_THREADS, the SLURM allocation
+# ($SLURM_CPUS_PER_TASK) or every available core
+def resolve_threads(threads=None):
+    for value in (threads, os.environ.get(INTRA_THREADS), os.environ.get('SLURM_CPUS_PER_TASK')):
+        if value:
+            return int(value)
+    return available_cores()
+
+# CPU list such as '0-3,8,10-11'
+def parse_cpus(cpus):
+    result = set()
+    for part in str(cpus).split(','):
+        first, _, last = part.partition('-')
+        result.update(range(int(first), int(last or first) + 1))
+    return result
+
+# Fix the TensorFlow thread pools (and, optionally, the CPUs) of this process
+# affinity: CPU list to pin the process to ('auto' is resolved by launch() into $TF_CPU_AFFINITY)
+# An explicit CPU list wins over $TF_CPU_AFFINITY
+# Must be called before TensorFlow runs any op
+# Returns: the intra-op and inter-op threads
+def configure_threads(threads=None, inter_threads=None, affinity=None):
+    cpus = affinity if affinity and affinity != 'auto' else os.environ.get(AFFINITY)
+    if cpus:
+        os.sched_setaffinity(0, parse_cpus(cpus))
+
+    threads = resolve_threads(threads)
+    inter_threads = inter_threads or int(os.environ.get(INTER_THREADS, 0)) or min(threads, 2)
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+    print("TensorFlow threads: " + str(threads) + " intra-op, " + str(inter_threads) + " inter-op" +
+          (", CPUs " + cpus if cpus else ""))
+    return threads, inter_threads
+
+# Run the current command as one chief oracle plus `workers` tuner processes on this node
+# Each worker pulls trials from the chief and trains them with `threads` threads
+# With shared=True there is no chief: the workers claim trials through the project directory
+# With affinity=True every worker is pinned to its own `threads` cores
+# Returns: the chief's exit code (the chief, or tuner0, runs the post-search code)
+def launch(workers, threads=None, project_dir=None, overwrite=True, shared=False, affinity=False):
+    threads = threads or max(1, available_cores() // workers)
+
+    # Clear the project once, the child processes never overwrite it
+    if overwrite and project_dir and os.path.exists(project_dir):
+        shutil.rmtree(project_dir)
+
+    env = dict(os.environ)
+    env['OMP_NUM_THREADS'] = str(threads)
+    argv = [sys.executable] + sys.argv + ['--threads', str(threads)]
+
+    if shared:
+        env[SHARED] = '1'
+        tuners = [subprocess.Popen(argv, env=_worker_env(env, i, threads, affinity)) for i in range(workers)]
+        print("Launched " + str(workers) + " shared-directory workers with " + str(threads) + " threads each")
+        return [tuner.wait() for tuner in tuners][0]
+
+    env[ORACLE_IP] = '127.0.0.1'
+    env[ORACLE_PORT] = str(_free_port())
+    chief = subprocess.Popen(argv, env=dict(env, **{TUNER_ID: 'chief'}))
+    tuners = [subprocess.Popen(argv, env=_worker_env(env, i, threads, affinity)) for i in range(workers)]
+
+    print("Launched " + str(workers) + " workers with " + str(threads) + " threads each")
+    for tuner in tuners:
+        tuner.wait()
+    return chief.wait()
+
+# Oracle synchronized through the project directory (no gRPC service)
+# Every call reloads the state written by the other workers and saves its changes while
+# holding the project lock. A trial is claimed by writing it as ongoing for this worker
+# in oracle.json; trial.json and oracle.json are replaced atomically
+class SharedOracle:
+    def create_trial(self, tuner_id):
+        with self._locked():
+            trial = super(SharedOracle, self).create_trial(tuner_id)
+
+        # Hyperband waits for the other workers to finish a bracket
+        if trial.status == 'IDLE':
+            time.sleep(1)
+        return trial
+
+    def update_trial(self, trial_id, metrics, step=0):
+        with self._locked():
+            return super(SharedOracle, self).update_trial(trial_id, metrics, step)
+
+    def end_trial(self, trial_id, status='COMPLETED'):
+        with self._locked():
+            super(SharedOracle, self).end_trial(trial_id, status)
+
+    def update_space(self, hyperparameters):
+        with self._locked():
+            super(SharedOracle, self).update_space(hyperparameters)
+            self.save()
+
+    def get_best_trials(self, num_trials=1):
+        with self._locked():
+            return super(SharedOracle, self).get_best_trials(num_trials)
+
+    # Block until no worker is running a trial
+    # A running trial whose directory has not changed for `timeout` seconds (no checkpoint,
+    # fold or metric written) belongs to a dead worker: it is ended as INVALID and reported
+    def wait(self, poll=30, timeout=TRIAL_TIMEOUT):
+        while True:
+            with self._locked():
+                for tuner_id, trial in list(self.ongoing_trials.items()):
+                    idle = time.time() - _last_modified(self._get_trial_dir(trial.trial_id))
+                    if idle > timeout:
+                        print("Trial " + trial.trial_id + " of " + tuner_id + " has not changed for " +
+                              str(int(idle)) + " s, its worker is taken as dead: ended as INVALID")
+                        self.end_trial(trial.trial_id, 'INVALID')
+                running = len(self.ongoing_trials)
+            if not running:
+                return
+            print("Waiting for " + str(running) + " running trials")
+            time.sleep(poll)
+
+    def save(self):
+        _write_json(self._get_oracle_fname(), self.get_state())
+
+    def _save_trial(self, trial):
+        _write_json(os.path.join(self._get_trial_dir(trial.trial_id), 'trial.json'), trial.get_state())
+
+    # Hold the project lock and reload the state of the other workers (reentrant)
+    @contextlib.contextmanager
+    def _locked(self):
+        depth = getattr(self, '_lock_depth', 0)
+        if not depth:
+            self._lock_owner = _acquire(os.path.join(self._project_dir, 'oracle.lock'))
+        self._lock_depth = depth + 1
+        try:
+            if not depth and os.path.exists(self._get_oracle_fname()):
+                self.reload()
+            yield
+        finally:
+            self._lock_depth = depth
+            if not depth:
+                _release(os.path.join(self._project_dir, 'oracle.lock'), self._lock_owner)
+
+# Turn the oracle of a tuner into a SharedOracle
+def share_oracle(oracle):
+    oracle.__class__ = type('Shared' + type(oracle).__name__, (SharedOracle, type(oracle)), {})
+    return oracle
+
+# Lock file created atomically (O_EXCL also works on NFS v3+), holding the owner of the lock:
+# 'hostname pid nonce', different for every acquisition
+# A stale lock is broken by renaming it aside (only one worker can move it) and checking
+# that the moved lock is the stale one: a fresh lock moved by a late worker is put back
+# Returns: the owner written in the lock
+def _acquire(fname):
+    owner = socket.gethostname() + ' ' + str(os.getpid()) + ' ' + '%016x' % random.getrandbits(64)
+    while True:
+        try:
+            fd = os.open(fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, owner.encode())
+            os.close(fd)
+            return owner
+        except FileExistsError:
+            pass
+
+        try:
+            stale = _read_owner(fname)
+            if time.time() - os.path.getmtime(fname) > LOCK_TIMEOUT:
+                moved = _move_aside(fname)
+                if _read_owner(moved) == stale:
+                    print("Breaking stale lock " + fname + " (" + stale + ")")
+                    os.remove(moved)
+                else:
+                    _put_back(moved, fname)
+        except FileNotFoundError:
+            pass
+        time.sleep(random.uniform(0.05, 0.2))
+
+# Remove the lock only if this worker still owns it (it may have been broken as stale
+# while held, and then belong to another worker)
+def _release(fname, owner):
+    try:
+        moved = _move_aside(fname)
+    except FileNotFoundError:
+        print("Warning: lock " + fname + " was broken while held by this worker")
+        return
+    if _read_owner(moved) == owner:
+        os.remove(moved)
+    else:
+        print("Warning: lock " + fname + " was broken while held by this worker, it is left to its new owner")
+        _put_back(moved, fname)
+
+def _read_owner(fname):
+    with open(fname) as f:
+        return f.read()
+
+# Atomic rename to a name of this process
+def _move_aside(fname):
+    moved = fname + '.' + socket.gethostname() + '.' + str(os.getpid())
+    os.rename(fname, moved)
+    return moved
+
+# Restore a lock moved by mistake, unless a new lock was created meanwhile (link does not replace)
+def _put_back(moved, fname):
+    try:
+        os.link(moved, fname)
+    except FileExistsError:
+        pass
+    os.remove(moved)
+
+# Readers never see a partially written file
+def _write_json(fname, state):
+    tmp = fname + '.' + socket.gethostname() + '.' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, fname)
+
+# Environment of the i-th worker: its tuner id and, with affinity, its slice of the cores
+# Workers without a whole slice (fewer cores than workers * threads) are not pinned
+def _worker_env(env, i, threads, affinity):
+    env = dict(env, **{TUNER_ID: 'tuner' + str(i)})
+    if not affinity:
+        return env
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    if len(cores) >= (i + 1) * threads:
+        env[AFFINITY] = ','.join(str(core) for core in cores[i * threads:(i + 1) * threads])
+    else:
+        print("Warning: --affinity auto needs " + str((i + 1) * threads) + " cores for tuner" + str(i) +
+              " (" + str(len(cores)) + " available), the worker is not pinned")
+    return env
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Last modification time of a directory or any file under it (0 if it does not exist)
+def _last_modified(directory):
+    latest = os.path.getmtime(directory) if os.path.exists(directory) else 0
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+            except FileNotFoundError:
+                pass
+    return latest
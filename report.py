@@ -0,0 +1,111 @@
+# Resource report of finished searches
+# Input parameters (project directories, --top, -o)
+# Reads the telemetry of every trial (telemetry.json, see telemetry.py) and reports where
+# the search time goes: time per trial status, fold throughput, the most expensive trials
+# and the mean trial time of every hyperparameter value
+
+import telemetry
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# One row per trial: resources of the trial, mean resources of its folds and serving cost
+def trial_rows(records):
+  rows = []
+  for record in records:
+    folds = record.get('folds', [])
+    cost = record.get('cost') or {}
+    rows.append({
+        'trial_id': record['trial_id'],
+        'status': record['status'],
+        'score': record['score'],
+        'wall_seconds': record['wall_seconds'],
+        'cpu_utilization': record['cpu_utilization'],
+        'peak_rss_mb': record['peak_rss'] / 2**20,
+        'epochs': record['epochs'],
+        'folds': len(folds),
+        'fold_seconds': np.mean([fold['wall_seconds'] for fold in folds]) if folds else np.nan,
+        'samples_per_sec': np.mean([fold['samples_per_sec'] for fold in folds]) if folds else _number(record.get('samples_per_sec')),
+        'latency_ms': cost.get('latency_ms', np.nan),
+        'mflops': cost.get('flops', np.nan) / 1e6
+    })
+  return pd.DataFrame(rows)
+
+# Measurement that may be missing (None: cached and infeasible trials have no throughput)
+def _number(value):
+  return np.nan if value is None else value
+
+def report(project_dir, args):
+  records = telemetry.load_project(project_dir)
+  if not records:
+    print(f"{project_dir}: no trials with telemetry")
+    return None
+
+  trials = trial_rows(records)
+  values = pd.DataFrame([record['values'] for record in records])
+  hours = trials['wall_seconds'].sum() / 3600
+
+  print("----------------------------------------------")
+  print(f"Search {project_dir}: {len(trials)} trials, {hours:.2f} hours")
+  print("> status | trials | hours | share of the time")
+  for status, group in trials.groupby('status'):
+    print(f"> {status} | {len(group)} | {group['wall_seconds'].sum() / 3600:.2f} | {group['wall_seconds'].sum() / 3600 / hours:.0%}")
+
+  # Epochs per fold of the cross-validated trials, per trained trial of the holdout ones (run.py)
+  if trials['folds'].sum():
+    print(f"> Mean fold: {trials['fold_seconds'].mean():.1f} s - {trials['samples_per_sec'].mean():.1f} samples/s - "
+          f"{trials['epochs'].sum() / trials['folds'].sum():.1f} epochs")
+  else:
+    trained = trials[trials['epochs'] > 0]
+    print(f"> Mean trained trial: {trained['wall_seconds'].mean():.1f} s - {trained['samples_per_sec'].mean():.1f} samples/s - "
+          f"{trained['epochs'].sum() / max(len(trained), 1):.1f} epochs")
+  print(f"> CPU utilization: {trials['cpu_utilization'].mean():.0%} - peak RSS: {trials['peak_rss_mb'].max():.0f} MB")
+
+  print("> Most expensive trials:")
+  print("> trial | status | minutes | epochs | samples/s | ms/tweet | peak RSS (MB) | CPU | score")
+  for i, row in trials.sort_values('wall_seconds', ascending=False).head(args.top).iterrows():
+    print(f"> {row['trial_id']} | {row['status']} | {row['wall_seconds'] / 60:.1f} | {row['epochs']} | {row['samples_per_sec']:.1f} | "
+          f"{row['latency_ms']:.2f} | {row['peak_rss_mb']:.0f} | {row['cpu_utilization']:.0%} | {row['score']}")
+    print(f">   {', '.join(f'{name}={value}' for name, value in values.loc[i].dropna().items() if not name.startswith('tuner/'))}")
+
+  # Hyperparameters whose values change the trial time the most
+  print("> Mean minutes per trial by hyperparameter value:")
+  for name in values.columns:
+    if name.startswith('tuner/') or values[name].nunique() < 2:
+      continue
+    means = (trials['wall_seconds'] / 60).groupby(values[name]).mean()
+    print(f"> {name}: {' | '.join(f'{value}: {minutes:.1f}' for value, minutes in means.items())}")
+  print("----------------------------------------------")
+
+  return pd.concat([trials, values], axis=1).assign(project=os.path.basename(os.path.normpath(project_dir)))
+
+def main(args):
+  tables = [report(project_dir, args) for project_dir in args.projects]
+  tables = [table for table in tables if table is not None]
+
+  if args.output and tables:
+    pd.concat(tables, ignore_index=True).to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("projects",
+                  nargs='+',
+                  help="Project directories of the searches (e.g. ../hp_trials/lstm_sel)")
+
+  ap.add_argument("--top",
+                  type=int,
+                  default=10,
+                  help="Most expensive trials to list")
+
+  ap.add_argument("-o",
+                  "--output",
+                  default=None,
+                  help="CSV file with one row per trial")
+
+  args = ap.parse_args()
+  main(args)
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Files of a trial directory stored with its result (see run_cv.CVTuner)
+TRIAL_FILES = ['folds.json', 'threshold.json', 'oof.npy', 'fold_weights.json']
+RESULT_FILE = 'result.json'
+
+# Weight arrays referenced by the fold_weights.json of the entries, content-addressed
+# as in the weight store of a project (see crossval.save_weights) and shared by every entry
+WEIGHTS_DIR = 'fold_weights'
+
+# Fingerprint of a dataset: hash of the dtype, shape and content of every array
+# (model inputs and labels)
+def fingerprint(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        for a in (array if isinstance(array, (list, tuple)) else [array]):
+            a = np.ascontiguousarray(np.asarray(a))
+            digest.update(str(a.dtype).encode('utf8'))
+            digest.update(str(a.shape).encode('utf8'))
+            digest.update(a.tobytes())
+    return digest.hexdigest()
+
+# Persistent results of already evaluated configurations, shared by every search
+# One directory per configuration: result.json (the metrics reported to the oracle),
+# the checkpoint of the best step and the cross-validation files of the trial
+# (the fold weights go to the weight store of the cache)
+class ResultCache:
+    def __init__(self, directory, **context):
+        self.directory = directory
+        self.context = context      # Model, lexicon, dataset...
+        os.makedirs(directory, exist_ok=True)
+
+    # Canonical key of a configuration: sorted JSON of the hyperparameter values and the context
+    # (the bookkeeping values of keras-tuner, 'tuner/...', are left out)
+    def key(self, values, **context):
+        values = {name: value for name, value in values.items() if not name.startswith('tuner/')}
+        canonical = json.dumps({'values': values, 'context': dict(self.context, **context)}, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+    # Copy a cached result into the directory of a new trial
+    # The checkpoint goes back under the step it was stored from (the best step of the trial)
+    # Returns: the cached metrics and step, None if the configuration was never evaluated
+    def restore(self, key, tuner, trial_id):
+        entry = os.path.join(self.directory, key)
+        if not os.path.exists(os.path.join(entry, RESULT_FILE)):
+            return None
+        with open(os.path.join(entry, RESULT_FILE)) as f:
+            result = json.load(f)
+        step = result.get('step', 0)
+
+        for name in TRIAL_FILES:
+            if os.path.exists(os.path.join(entry, name)):
+                shutil.copy(os.path.join(entry, name), tuner.get_trial_dir(trial_id))
+        if os.path.exists(os.path.join(entry, 'fold_weights.json')):
+            _copy_arrays(_weight_keys(entry), os.path.join(self.directory, WEIGHTS_DIR), tuner._weight_store())
+
+        checkpoint_dir = tuner._get_checkpoint_dir(trial_id, step)
+        if os.path.exists(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        shutil.copytree(os.path.join(entry, 'checkpoint'), checkpoint_dir)
+
+        return result['metrics'], step
+
+    # Store the result of a finished trial
+    # step: checkpoint of the trial to keep, the one its score comes from
+    # The entry is written aside and renamed, concurrent workers keep the first one
+    # Trials without that checkpoint (already rotated out) are not stored
+    def store(self, key, tuner, trial_id, metrics, step=0):
+        entry = os.path.join(self.directory, key)
+        checkpoint_dir = tuner._get_checkpoint_dir(trial_id, step)
+        if os.path.exists(entry):
+            return
+        if not os.path.exists(checkpoint_dir) or not os.listdir(checkpoint_dir):
+            return
+
+        tmp = entry + '.' + str(os.getpid())
+        shutil.copytree(checkpoint_dir, os.path.join(tmp, 'checkpoint'))
+        for name in TRIAL_FILES:
+            if os.path.exists(os.path.join(tuner.get_trial_dir(trial_id), name)):
+                shutil.copy(os.path.join(tuner.get_trial_dir(trial_id), name), tmp)
+        if os.path.exists(os.path.join(tmp, 'fold_weights.json')):
+            _copy_arrays(_weight_keys(tmp), tuner._weight_store(), os.path.join(self.directory, WEIGHTS_DIR))
+        with open(os.path.join(tmp, RESULT_FILE), 'w') as f:
+            json.dump({'metrics': {name: float(value) for name, value in metrics.items()}, 'step': int(step)}, f)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)
+
+# Keys of the weight arrays of every fold in the fold_weights.json of a directory
+def _weight_keys(directory):
+    with open(os.path.join(directory, 'fold_weights.json')) as f:
+        return {key for keys in json.load(f).values() for key in keys}
+
+# Copy the arrays missing from a content-addressed store (an array with the same key is the same array)
+def _copy_arrays(keys, source, target):
+    os.makedirs(target, exist_ok=True)
+    for key in keys:
+        fname = os.path.join(target, key + '.npy')
+        if not os.path.exists(fname):
+            shutil.copy(os.path.join(source, key + '.npy'), fname + '.' + str(os.getpid()))
+            os.replace(fname + '.' + str(os.getpid()), fname)
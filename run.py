@@ -4,18 +4,22 @@
 # Feature infusion
 
 import loadembeddings
-import loadfeatures
+import loaddata
 import buildmodel
+import evaluate
+import export
+import parallel
+import costmodel
+import resultcache
+import telemetry
 
 import argparse
 import numpy as np
-import pandas as pd
 import tensorflow as tf
-import re, random, os
+import re, random, os, gc
 import kerastuner
 import sys
 
-from tensorflow.keras import preprocessing
 from statistics import mean, median
 from tensorflow import keras
 from tensorflow.keras import layers, initializers
@@ -25,14 +29,150 @@ from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils import class_weight
 from gensim.models import KeyedVectors
 
+# Trials of an already evaluated configuration reuse its cached result (see resultcache.py)
+class CachedTuner:
+  def __init__(self, *args, cache=None, **kwargs):
+    super(CachedTuner, self).__init__(*args, **kwargs)
+    self.cache = cache
+    self._fingerprint = None
+    self._cached = set()        # Trials that reused a cached result
+
+  def run_trial(self, trial, *args, **kwargs):
+    if self.cache is None:
+      return super(CachedTuner, self).run_trial(trial, *args, **kwargs)
+
+    # Hyperband trials continue the previous ones from 'tuner/initial_epoch'
+    hp = trial.hyperparameters
+    epochs = [hp.values.get('tuner/initial_epoch', 0), hp.values.get('tuner/epochs', kwargs.get('epochs'))]
+    key = self.cache.key(hp.values, tuner='holdout', epochs=epochs, dataset=self._fingerprint)
+
+    cached = self.cache.restore(key, self, trial.trial_id)
+    if cached is not None:
+      metrics, step = cached
+      print('Cached result: ' + str(metrics))
+      self._cached.add(trial.trial_id)
+      self.oracle.update_trial(trial.trial_id, metrics, step=step)
+      return
+
+    # The oracle scores the trial by its best step and the best models load its checkpoint,
+    # so that is the step cached (epochs are absolute, Hyperband trials start at 'tuner/initial_epoch')
+    super(CachedTuner, self).run_trial(trial, *args, **kwargs)
+    tracker = self.oracle.get_trial(trial.trial_id).metrics
+    best_step = tracker.get_best_step(self.oracle.objective.name)
+    self.cache.store(key, self, trial.trial_id, {name: tracker.get_best_value(name) for name in tracker.metrics},
+                     step=best_step)
+
+  def search(self, x, y, *args, **kwargs):
+    if self.cache is not None:
+      self._fingerprint = resultcache.fingerprint(x, y)
+    super(CachedTuner, self).search(x, y, *args, **kwargs)
+
+# Telemetry status of the trials over the cost budget (never trained)
+INFEASIBLE = 'INFEASIBLE'
+
+# Trials measure their static cost (see costmodel.model_cost) and serving cost
+# (see evaluate.serving_cost) before training
+# Configurations over the budget are never trained: they end COMPLETED with the worst
+# score (see costmodel.worst_score), so the oracle learns from them, and count toward -t
+# (the oracle already leaves out the ones over the FLOPs or parameters budget, see costmodel.BudgetOracle)
+class BudgetTuner:
+  def __init__(self, *args, max_latency=None, max_flops=None, max_params=None, **kwargs):
+    super(BudgetTuner, self).__init__(*args, **kwargs)
+    self.budget = {'latency_ms': max_latency, 'flops': max_flops, 'trainable_params': max_params}
+    self._infeasible = set()
+
+  def run_trial(self, trial, *args, **kwargs):
+    x = args[0] if args else kwargs['x']
+    sample = [inp[:512] for inp in x] if isinstance(x, list) else x[:512]
+    model = self.hypermodel.build(trial.hyperparameters)
+    cost = costmodel.model_cost(model)
+    cost.update(evaluate.serving_cost(model, sample))
+    evaluate.save_cost(self.get_trial_dir(trial.trial_id), cost)
+
+    # The measured model is released before the trial builds its own
+    del model
+    tf.keras.backend.clear_session()
+    print(f"Cost: {cost['trainable_params']} trainable params - {cost['flops'] / 1e6:.2f} MFLOPs/tweet - {cost['activation_bytes'] / 2**10:.1f} KB/tweet - {cost['latency_ms']:.2f} ms/tweet - {cost['batch_latency_ms']:.3f} ms/tweet batched")
+
+    over = costmodel.over_budget(cost, self.budget)
+    if over:
+      print(f"Trial {trial.trial_id} over the budget ({', '.join(over)}), not trained")
+      self._infeasible.add(trial.trial_id)
+      objective = self.oracle.objective
+      scores = [t.score for t in self.oracle.get_best_trials(num_trials=100000)]
+      self.oracle.update_trial(trial.trial_id, {objective.name: costmodel.worst_score(objective.direction, scores)})
+      return
+    super(BudgetTuner, self).run_trial(trial, *args, **kwargs)
+
+# Every trial releases its models (graphs and weights) when it ends, and the resident
+# memory is checked after it (see parallel.MemoryGuard)
+class MemoryTuner:
+  def __init__(self, *args, max_rss_growth=None, **kwargs):
+    super(MemoryTuner, self).__init__(*args, **kwargs)
+    self.memory_guard = parallel.MemoryGuard(parallel.memory_log(self.project_dir), max_rss_growth)
+
+  def on_trial_end(self, trial):
+    super(MemoryTuner, self).on_trial_end(trial)
+    tf.keras.backend.clear_session()
+    gc.collect()
+    self.memory_guard.check(trial.trial_id)
+
+# Resources of every trial (see telemetry.Meter), stored in telemetry.json of its directory
+# Epochs run come from the metrics history; cached and infeasible trials train nothing:
+# 0 epochs and no throughput
+class TelemetryTuner:
+  def on_trial_begin(self, trial):
+    super(TelemetryTuner, self).on_trial_begin(trial)
+    self._meter = telemetry.Meter().start()
+    self._fit_samples = 0
+
+  def run_trial(self, trial, *args, **kwargs):
+    x = args[0] if args else kwargs['x']
+    rows = len(x[0] if isinstance(x, list) else x)
+    self._fit_samples = int(rows * (1 - kwargs.get('validation_split', 0)))
+    super(TelemetryTuner, self).run_trial(trial, *args, **kwargs)
+
+  def on_trial_end(self, trial):
+    super(TelemetryTuner, self).on_trial_end(trial)
+    trial = self.oracle.get_trial(trial.trial_id)
+    cached = trial.trial_id in self._cached
+    epochs = len(trial.metrics.get_history('loss')) if trial.metrics.exists('loss') and not cached else 0
+    meter = self._meter.stop()
+    telemetry.save(self.get_trial_dir(trial.trial_id),
+                   meter.record(trial_id=trial.trial_id,
+                                status=INFEASIBLE if trial.trial_id in self._infeasible else trial.status,
+                                cached=cached,
+                                epochs=epochs,
+                                samples_per_sec=self._fit_samples * epochs / meter.wall_seconds if epochs else None,
+                                cost=evaluate.load_cost(self.get_trial_dir(trial.trial_id))))
+
+# kerastuner's Hyperband tuner with a given oracle (it builds its own HyperbandOracle)
+class HyperbandTuner(kerastuner.tuners.Hyperband):
+  def __init__(self, oracle, hypermodel, **kwargs):
+    kerastuner.engine.multi_execution_tuner.MultiExecutionTuner.__init__(self, hypermodel=hypermodel, oracle=oracle, **kwargs)
+
 # Tune hyperparameters
-class MyTuner(kerastuner.tuners.RandomSearch):
+class MyTuner(MemoryTuner, TelemetryTuner, BudgetTuner, CachedTuner, kerastuner.engine.multi_execution_tuner.MultiExecutionTuner):
+  def __init__(self, *args, batch_sizes=buildmodel.BATCH_SIZES, **kwargs):
+    super(MyTuner, self).__init__(*args, **kwargs)
+    self.batch_sizes = batch_sizes
+
   def run_trial(self, trial, *args, **kwargs):
     # You can add additional HyperParameters for preprocessing and custom training loops
     # via overriding `run_trial`
-    kwargs['batch_size'] = trial.hyperparameters.Choice('batch_size', values=[8, 16, 32, 64, 128, 256])
+    kwargs['batch_size'] = trial.hyperparameters.Choice('batch_size', values=self.batch_sizes)
     #kwargs['epochs'] = trial.hyperparameters.Int('epochs', 100, 500)
     super(MyTuner, self).run_trial(trial, *args, **kwargs)
+
+# Same tuner with Hyperband: short budgets first, only the best configurations get more epochs
+class MyHyperbandTuner(MemoryTuner, TelemetryTuner, BudgetTuner, CachedTuner, HyperbandTuner):
+  def __init__(self, *args, batch_sizes=buildmodel.BATCH_SIZES, **kwargs):
+    super(MyHyperbandTuner, self).__init__(*args, **kwargs)
+    self.batch_sizes = batch_sizes
+
+  def run_trial(self, trial, *args, **kwargs):
+    kwargs['batch_size'] = trial.hyperparameters.Choice('batch_size', values=self.batch_sizes)
+    super(MyHyperbandTuner, self).run_trial(trial, *args, **kwargs)
     
 def main(args):
   print("Version", tf.__version__)
@@ -40,92 +180,24 @@ def main(args):
   print("GPUS", tf.config.list_physical_devices('GPU'))
 
   # Data loading
-  #path = '../data/HaterNet/'
-
-  #training_set = pd.read_csv(path + 'train_prep_uncased.tsv', sep='\t')
-  #test_set = pd.read_csv(path + 'test_prep_uncased.tsv', sep='\t')
-
-  path = '../data/HatEval/'
-  training_set = pd.read_csv(path + 'train.tsv', sep='\t')
-  test_set = pd.read_csv(path + 'test.tsv', sep='\t')
-
-  #HaterNet
-
-  # Remove accents from train
-  #x_train = training_set.text
-  #y_train = training_set.label
-
-  # Remove accents from test
-  #x_test = test_set.text
-  #y_test = test_set.label
-
-  #HatEval
-
-  x_train = training_set.iloc[:,3]
-  y_train = training_set.iloc[:,1]
-
-  x_test = test_set.iloc[:,3]
-  y_test = test_set.iloc[:,1]
-  
-  # Normalize dataset for the lexicon matching
-  norm_train = x_train.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-  norm_test = x_test.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(args.dataset)
 
   # Lexicon loading
-  if args.lexicon == 'sel':
-    lexicon = loadfeatures.SEL(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'liwc':
-    lexicon = loadfeatures.SpanishLIWC(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'emolex':
-    lexicon = loadfeatures.Emolex(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'isal':
-    lexicon = loadfeatures.iSAL(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'all':
-    lexicon = loadfeatures.All(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  else:
-    print("No se utilizará lexicon.")
-    
-  # Store each tweet as a list of tokens
-  token_list = []
-  for text in x_train:
-    token_list.append(preprocessing.text.text_to_word_sequence(text))
-
-  # For each list of tokens, store its length
-  len_texts = []
-  for index, tweet in enumerate(token_list):
-    len_texts.append(len(tweet))
+  lex_train, lex_test = loaddata.load_lexicon(args.lexicon, [x_train, x_test])
 
   # Tokenize
-  max_words = 10000   # Top most frequent words
-  max_seq = 75       # Size to be padded to (should be greater than the max value=70)
-
-  # Create a tokenize that takes the 10000 most common words
-  tokenizer = preprocessing.text.Tokenizer(num_words=max_words)
+  max_seq = loaddata.MAX_SEQ
 
   # Fit the tokenizer to the dataset
-  tokenizer.fit_on_texts(x_train)
+  tokenizer = loaddata.fit_tokenizer(x_train)
 
   # Dictionary ordered by total frequency
   word_index = tokenizer.word_index
   vocab_size = len(word_index) + 1
 
-  # Transform each tweet into a numerical sequence
-  train_sequences = tokenizer.texts_to_sequences(x_train)
-  test_sequences = tokenizer.texts_to_sequences(x_test)
-
-  # Fill each sequence with zeros until max_seq
-  x_train = preprocessing.sequence.pad_sequences(train_sequences, maxlen=max_seq)
-  x_test = preprocessing.sequence.pad_sequences(test_sequences, maxlen=max_seq)
+  # Transform each tweet into a padded numerical sequence
+  x_train = loaddata.to_sequences(tokenizer, x_train, max_seq)
+  x_test = loaddata.to_sequences(tokenizer, x_test, max_seq)
 
   # Load embeddings
   path = '../embeddings/embeddings-l-model.vec'
@@ -141,35 +213,69 @@ def main(args):
     keras.metrics.AUC(name='auc')
   ]
 
-  # Number of emotions
-  num_emotions = len(lex_train.columns)
-  print("Número de emociones en el lexicón: " + str(num_emotions))
-
-  if args.lexicon:
-    #model = buildmodel.LSTMFeaturesModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, args.lexicon, METRICS)
-    model = buildmodel.LSTMFeaturesModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions, METRICS)
+  # Hypermodel of the model (see buildmodel.MODELS), with the lexicon features if given
+  num_emotions = len(lex_train.columns) if args.lexicon else None
+  if num_emotions:
+    print("Número de emociones en el lexicón: " + str(num_emotions))
+  model = buildmodel.get_hypermodel(args.model, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions, METRICS)
+  
+  epochs = 15
 
+  # Results shared by every search of this model, lexicon and dataset
+  cache = None
+  if args.cache:
+    cache = resultcache.ResultCache(args.cache, model=args.model, lexicon=args.lexicon, dataset=args.dataset)
+
+  # Search algorithm: only configurations within the FLOPs and parameters budgets are proposed
+  if args.search == 'hyperband':
+    oracle = costmodel.BudgetHyperband(
+        objective=kerastuner.Objective("val_accuracy", direction="max"),   # Objective metric
+        max_epochs=epochs,                                            # Largest budget of a trial
+        factor=args.factor,                                           # Fraction (1/factor) promoted to each budget
+        hypermodel=model,                                             # Model whose cost is checked
+        max_flops=args.max_flops,                                     # FLOPs per tweet budget
+        max_params=args.max_params)                                   # Trainable parameters budget
   else:
-    # Create a model instance for the tuner
-    if args.model == 'lstm':
-      model = buildmodel.LSTMModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    elif args.model == 'bilstm':
-      model = buildmodel.BiLSTMModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    elif args.model == 'cnn':
-      model = buildmodel.CNNModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    else:
-      print("Wrong model. Please, choose another one.")
-      exit()
-  
+    oracle = costmodel.BudgetRandomSearch(
+        objective=kerastuner.Objective("val_accuracy", direction="max"),   # Objective metric
+        max_trials=args.trials,                                       # Maximum number of trials
+        hypermodel=model,                                             # Model whose cost is checked
+        max_flops=args.max_flops,                                     # FLOPs per tweet budget
+        max_params=args.max_params)                                   # Trainable parameters budget
+
   # Create the tuner
-  tuner = MyTuner(
-      model,                                                        # Model's function name
-      objective=kerastuner.Objective("val_accuracy", direction="max"),   # Objective metric
-      max_trials=args.trials,                                       # Maximum number of trials
-      executions_per_trial=1,                                       # Increase this to reduce results variance
-      directory='../hp_trials/',                                    # Directory to store the models
-      project_name=args.model + "_" + args.lexicon,                 # Project name
-      overwrite=True)                                               # Overwrite the project
+  if args.search == 'hyperband':
+    tuner = MyHyperbandTuner(
+        hypermodel=model,                                             # Model's function name
+        oracle=oracle,                                                # Search algorithm
+        executions_per_trial=1,                                       # Increase this to reduce results variance
+        directory='../hp_trials/',                                    # Directory to store the models
+        project_name=args.model + "_" + str(args.lexicon),            # Project name
+        cache=cache,                                                  # Results of already evaluated configurations
+        batch_sizes=args.batch_sizes,                                 # Batch sizes to tune
+        max_latency=args.max_latency,                                 # Single-tweet latency budget
+        max_flops=args.max_flops,                                     # FLOPs per tweet budget
+        max_params=args.max_params,                                   # Trainable parameters budget
+        max_rss_growth=args.max_rss_growth and args.max_rss_growth * 2**20,  # Memory growth limit (bytes)
+        overwrite=not (args.resume or parallel.is_distributed()))     # Overwrite the project (done by the launcher in parallel mode)
+  else:
+    tuner = MyTuner(
+        hypermodel=model,                                             # Model's function name
+        oracle=oracle,                                                # Search algorithm
+        executions_per_trial=1,                                       # Increase this to reduce results variance
+        directory='../hp_trials/',                                    # Directory to store the models
+        project_name=args.model + "_" + str(args.lexicon),            # Project name
+        cache=cache,                                                  # Results of already evaluated configurations
+        batch_sizes=args.batch_sizes,                                 # Batch sizes to tune
+        max_latency=args.max_latency,                                 # Single-tweet latency budget
+        max_flops=args.max_flops,                                     # FLOPs per tweet budget
+        max_params=args.max_params,                                   # Trainable parameters budget
+        max_rss_growth=args.max_rss_growth and args.max_rss_growth * 2**20,  # Memory growth limit (bytes)
+        overwrite=not (args.resume or parallel.is_distributed()))     # Overwrite the project (done by the launcher in parallel mode)
+
+  # Workers coordinate through the project directory
+  if parallel.is_shared():
+    parallel.share_oracle(tuner.oracle)
 
   class_weights = class_weight.compute_class_weight('balanced',
                                                   np.unique(y_train),
@@ -183,25 +289,54 @@ def main(args):
       #keras.callbacks.TensorBoard(log_dir="./logs")
   ]
   
-  epochs = 15
   print("Searching...")
   if args.lexicon:
     tuner.search([x_train, lex_train], y_train, validation_split=0.20, epochs=epochs, verbose=0, callbacks=callbacks, class_weight = class_weights)
   else:
     tuner.search(x_train, y_train, validation_split=0.20, epochs=epochs, verbose=0, callbacks=callbacks, class_weight = class_weights)
 
+  # Workers only run trials, the chief reports the results
+  if parallel.is_worker():
+    return
+
+  # tuner0 reports once every shared-directory worker has finished its trial
+  if parallel.is_shared():
+    tuner.oracle.wait()
+
   # Save the best model
   best_model = tuner.get_best_models(num_models=1)
   print(tuner.results_summary(num_trials=1))
 
+  # Pareto front of the objective and the single-tweet latency
+  measured = [(t, evaluate.load_cost(tuner.get_trial_dir(t.trial_id))) for t in tuner.oracle.get_best_trials(num_trials=100000)]
+  measured = [(t, cost) for t, cost in measured if cost and not costmodel.over_budget(cost, tuner.budget)]
+  front = evaluate.pareto_front([t.score for t, _ in measured], [cost['latency_ms'] for _, cost in measured])
+  print('\nPARETO FRONT (val_accuracy vs single-tweet latency)\n')
+  for i in front:
+    trial, cost = measured[i]
+    print(f"Trial {trial.trial_id}: val_accuracy {trial.score:.4f} - {cost['latency_ms']:.2f} ms/tweet - {cost['batch_latency_ms']:.3f} ms/tweet batched - {cost['params']} params")
+
+  # Decision threshold maximizing the macro F1 on the validation split
+  # (Keras takes the last 20% of the training set)
+  split = int(len(x_train) * (1. - 0.20))
+  if args.lexicon:
+    y_prob = best_model[0].predict([np.array(x_train[split:]), lex_train[split:]], batch_size=128, verbose=0)
+  else:
+    y_prob = best_model[0].predict(np.array(x_train[split:]), batch_size=128, verbose=0)
+  threshold, val_f1 = evaluate.best_threshold(np.asarray(y_train)[split:], y_prob)
+  print(f"Decision threshold: {threshold:.4f} (validation f1 macro: {val_f1:.4f})")
+
   # Statistics
   if args.lexicon:
     y_prob = best_model[0].predict([np.array(x_test), lex_test], batch_size=128, verbose=1)
   else:
     y_prob = best_model[0].predict(np.array(x_test), batch_size=128, verbose=1)
     
-  y_classes = np.around(y_prob, decimals=0)
-  y_pred = y_classes.astype(int)
+  y_pred = (y_prob > threshold).astype(int)
+
+  test_scores = evaluate.evaluate_probs(y_test, y_prob, threshold)
+  print('\nTEST SCORES\n')
+  print(f"loss: {test_scores['loss']:.4f} - accuracy: {test_scores['accuracy']:.4f} - auc: {test_scores['auc']:.4f} - f1 macro: {test_scores['f1_macro']:.4f}")
 
   print('\nCLASSIFICATION REPORT\n')
   print(classification_report(y_test, y_pred, digits=4))
@@ -209,13 +344,24 @@ def main(args):
   print('\nCONFUSION MATRIX\n')
   print(confusion_matrix(y_test, y_pred))
 
+  # Standalone serving artifact
+  if args.export:
+    if args.lexicon:
+      representative_data = [x_train, lex_train.to_numpy()]
+    else:
+      representative_data = x_train
+    export.export_artifact(best_model[0], tokenizer, max_seq, args.lexicon, args.export, args.quantize, representative_data,
+                           threshold=threshold)
+
   print("\nParameters used:")
-  print(args.lexicon + " lexicon")
+  print(str(args.lexicon) + " lexicon")
+  print(args.search + " search")
   print(str(args.trials) + " trials")
   print(str(epochs) + " epochs")
   print("Weight balance")
   print("No Cross-validation")
   print("Metric: val_accuracy")
+  print(f"Decision threshold: {threshold:.4f}")
   
 if __name__ == "__main__":
   
@@ -233,7 +379,7 @@ if __name__ == "__main__":
 
   ap.add_argument("-m", 
                   "--model",
-                  choices=['lstm','bilstm','cnn'],
+                  choices=list(buildmodel.MODELS),
                   default='lstm',
                   help="Model to be built")
 
@@ -249,5 +395,106 @@ if __name__ == "__main__":
                   default=None,
                   help="Name of the lexicon to infuse")
 
+  ap.add_argument("-e",
+                  "--export",
+                  default=None,
+                  help="Directory to export the best model as a serving artifact")
+
+  ap.add_argument("-q",
+                  "--quantize",
+                  choices=['none', 'dynamic', 'int8'],
+                  default='dynamic',
+                  help="TFLite quantization of the exported model")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset to train with")
+
+  ap.add_argument("-w",
+                  "--workers",
+                  type=int,
+                  default=1,
+                  help="Number of local worker processes running trials in parallel")
+
+  ap.add_argument("--threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow threads per process (default: $TF_INTRA_OP_THREADS, $SLURM_CPUS_PER_TASK or cores / workers)")
+
+  ap.add_argument("--inter_threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow inter-op threads per process (default: $TF_INTER_OP_THREADS or min(threads, 2))")
+
+  ap.add_argument("--affinity",
+                  default=None,
+                  help="CPU list to pin this process to (e.g. 0-7), or 'auto' to pin every -w worker to its own cores")
+
+  ap.add_argument("-s",
+                  "--search",
+                  choices=['random', 'hyperband'],
+                  default='random',
+                  help="Search algorithm (hyperband ignores -t: its budget comes from the epochs and --factor)")
+
+  ap.add_argument("--factor",
+                  type=int,
+                  default=3,
+                  help="Hyperband reduction factor")
+
+  ap.add_argument("-r",
+                  "--resume",
+                  action='store_true',
+                  help="Continue the search stored in ../hp_trials/ instead of starting over")
+
+  ap.add_argument("--batch_sizes",
+                  type=int,
+                  nargs='+',
+                  default=buildmodel.BATCH_SIZES,
+                  help="Batch sizes to tune (see calibrate.py)")
+
+  ap.add_argument("--max_latency",
+                  type=float,
+                  default=None,
+                  help="Single-tweet latency budget in ms: slower configurations are not trained")
+
+  ap.add_argument("--max_flops",
+                  type=float,
+                  default=None,
+                  help="FLOPs per tweet budget: costlier configurations are never proposed (see spacecost.py)")
+
+  ap.add_argument("--max_params",
+                  type=int,
+                  default=None,
+                  help="Trainable parameters budget: larger configurations are never proposed (see spacecost.py)")
+
+  ap.add_argument("--max_rss_growth",
+                  type=int,
+                  default=None,
+                  help="Stop the search when the resident memory grows more than this many MB over the level after the first trial")
+
+  ap.add_argument("--cache",
+                  nargs='?',
+                  const='../hp_cache/',
+                  default=None,
+                  help="Reuse the results of already evaluated configurations stored in this directory (default: ../hp_cache/)")
+
+  ap.add_argument("--shared",
+                  action='store_true',
+                  help="Workers coordinate through the project directory instead of a chief oracle (one worker per srun task, or -w local workers)")
+
   args = ap.parse_args()
+
+  # Shared-directory search started by srun: this task is one of the workers
+  if args.shared and args.workers == 1:
+    parallel.join_shared()
+
+  # Parallel search: relaunch this command as chief + workers
+  if args.workers > 1 and not parallel.is_distributed():
+    project_dir = '../hp_trials/' + args.model + "_" + str(args.lexicon)
+    sys.exit(parallel.launch(args.workers, args.threads, project_dir, overwrite=not args.resume, shared=args.shared,
+                             affinity=args.affinity == 'auto'))
+
+  parallel.configure_threads(args.threads, args.inter_threads, args.affinity)
   main(args)
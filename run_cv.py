@@ -4,20 +4,24 @@
 # Feature infusion
 
 import loadembeddings
-import loadfeatures
+import loaddata
 import buildmodel
+import evaluate
+import export
+import parallel
+import crossval
+import costmodel
+import resultcache
+import telemetry
 
 import argparse
 import numpy as np
-import pandas as pd
 import tensorflow as tf
-import re, random, os
+import re, random, os, json, glob, gc
 import kerastuner as kt
 import sys
 import copy
 
-from kerastuner.engine import tuner_utils
-from tensorflow.keras import preprocessing
 from statistics import mean, median
 from tensorflow import keras
 from tensorflow.keras import layers, initializers
@@ -26,162 +30,447 @@ from tensorflow.keras.callbacks import EarlyStopping
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils import class_weight
 from gensim.models import KeyedVectors
-from sklearn.metrics import f1_score, precision_score, recall_score
-from sklearn.model_selection import StratifiedKFold
+
+# Trials stopped by fold pruning: COMPLETED for the oracle, so it learns from them, with the
+# mean of their finished folds capped below every fully cross-validated trial (see pruned_score)
+PRUNED = 'PRUNED'
+
+# Trials over the cost budget (never trained): COMPLETED for the oracle, with the worst
+# score (see costmodel.worst_score), and INFEASIBLE in their telemetry
+# (the oracle already leaves out the ones over the FLOPs or parameters budget, see costmodel.BudgetOracle)
+INFEASIBLE = 'INFEASIBLE'
 
 # Tune hyperparameters
 class CVTuner(kt.Tuner):
+  def __init__(self, *args, num_folds=10, fold_workers=1, fold_threads=None, prune_after=0, prune_min_trials=3, cache=None, batch_sizes=buildmodel.BATCH_SIZES, max_latency=None, max_flops=None, max_params=None, val_split=0.1, patience=3, oof_dtype='float32', save_fold_weights=False, max_rss_growth=None, seed=1, **kwargs):
+    super(CVTuner, self).__init__(*args, **kwargs)
+    self.num_folds = num_folds                  # K-Fold Cross Validator model evaluation
+    self.fold_workers = fold_workers            # Processes training folds in parallel
+    self.fold_threads = fold_threads            # Threads per fold process
+    self.prune_after = prune_after              # Folds before a trial can be pruned (0 = never)
+    self.prune_min_trials = prune_min_trials    # Completed trials needed to prune
+    self.cache = cache                          # resultcache.ResultCache of evaluated configurations
+    self.batch_sizes = batch_sizes              # Batch sizes to tune
+    self.val_split = val_split                  # Inner validation slice of every fold (0 = no early stopping)
+    self.patience = patience                    # Epochs without a better validation loss before stopping
+    self.oof_dtype = oof_dtype                  # Stored out-of-fold probabilities (float16 or float32)
+    self.save_fold_weights = save_fold_weights  # Store the weights of every fold (see crossval.save_weights)
+    self.seed = seed                            # Initial weights and random operations of every fold
+    self.budget = {'latency_ms': max_latency,   # Single-tweet latency (ms), FLOPs per tweet and
+                   'flops': max_flops,          # trainable parameters budgets (None = no budget)
+                   'trainable_params': max_params}
+    self.memory_guard = parallel.MemoryGuard(parallel.memory_log(self.project_dir), max_rss_growth)
+    self._pool = None
+    self._telemetry = {}                        # Meter and fold resources of the running trials
+    self._status = {}                           # Trials PRUNED or INFEASIBLE
+    self._fold_plan = None
+    self._fingerprint = None
+
   def run_trial(self, trial, x, y, *fit_args, **fit_kwargs):
     print('Running trial: ' + str(trial.trial_id))
 
     # Handle any callbacks passed to `fit`.
+    # Folds only get the user's callbacks: the oracle receives the cross-validated
+    # objective, not the training metrics of every epoch of every fold
     copied_fit_kwargs = copy.copy(fit_kwargs)
     callbacks = fit_kwargs.pop('callbacks', [])
     callbacks = self._deepcopy_callbacks(callbacks)
     self._configure_tensorboard_dir(callbacks, trial.trial_id)
-    callbacks.append(tuner_utils.TunerCallback(self, trial))
     copied_fit_kwargs['callbacks'] = callbacks
     
     # Batch size
     hp = trial.hyperparameters
-    batch_size = hp.Choice('batch_size', values=[8, 16, 32, 64, 128, 256])
-
-    # K-Fold Cross Validator model evaluation
-    fold_no = 1
-    num_folds = 10
-
-    # Statistics per fold
-    objective = []
-    f1_per_fold = []
-    precision_per_fold = []
-    recall_per_fold = []
-
-    # Define the K-Fold Cross Validator (Stratifield helps with imbalance)
-    kfold = StratifiedKFold(n_splits=num_folds, shuffle=False)
-    
-    # Merge both dataframes so KFold can split them
-    emb_x = pd.DataFrame(x[0]).T
-    lex_x = x[1].T
-    x = emb_x.append(lex_x, ignore_index=True)
-    x = x.T.to_numpy()
-
-    print(type(x))
-    print(x.shape)
-    # Perform CV
-    for train, dev in kfold.split(x,y):
+    batch_size = hp.Choice('batch_size', values=self.batch_sizes)
+
+    # Hyperband budget (every fold trains from scratch for that many epochs)
+    if 'tuner/epochs' in hp.values:
+      copied_fit_kwargs['epochs'] = hp.values['tuner/epochs']
+
+    objective_name = self.oracle.objective.name
+
+    # Static and serving cost of the configuration, measured before training
+    cost = self._serving_cost(trial.trial_id, hp, x)
+    print(f"Cost: {cost['trainable_params']} trainable params - {cost['flops'] / 1e6:.2f} MFLOPs/tweet - {cost['activation_bytes'] / 2**10:.1f} KB/tweet - {cost['latency_ms']:.2f} ms/tweet - {cost['batch_latency_ms']:.3f} ms/tweet batched")
+    over = costmodel.over_budget(cost, self.budget)
+    if over:
+      print(f"Trial {trial.trial_id} over the budget ({', '.join(over)}), not trained")
+      self._status[trial.trial_id] = INFEASIBLE
+      scores = [t.score for t in self.oracle.get_best_trials(num_trials=100000)]
+      self.oracle.update_trial(trial.trial_id, {objective_name: costmodel.worst_score(self.oracle.objective.direction, scores)})
+      return
+
+    # Configuration already evaluated, in this search or a previous one: reuse its result
+    if self.cache is not None:
+      key = self.cache.key(hp.values, tuner='cv', num_folds=self.num_folds, epochs=copied_fit_kwargs['epochs'],
+                           val_split=self.val_split, patience=self.patience, dataset=self._fingerprint)
+      cached = self.cache.restore(key, self, trial.trial_id)
+      if cached is not None:
+        metrics, _ = cached
+        print(f'Cached result: {objective_name} {metrics[objective_name]}')
+        self._telemetry[trial.trial_id]['cached'] = True
+        self.oracle.update_trial(trial.trial_id, metrics)
+        return
+
+    # Scores per fold (see evaluate.evaluate_probs) and out-of-fold probabilities
+    # (NaN for the folds not trained). A resumed trial starts after its finished folds
+    folds = self._load_folds(trial.trial_id)
+    oof_prob = self._load_oof(trial.trial_id, len(y))
+    if folds:
+      print(f'Resuming trial {trial.trial_id} after {len(folds)} folds')
+      previous = telemetry.load(self.get_trial_dir(trial.trial_id)) or {}
+      self._telemetry[trial.trial_id]['folds'] = previous.get('folds', [])[:len(folds)]
+
+    # Perform CV over the remaining folds of the plan
+    if self.fold_workers > 1:
+      # Every fold trains in its own process, results come back in fold order
       print('--------------------------------')
-      print(f'Training for fold {fold_no} ...')
-
-      x_train, x_dev = x[train], x[dev]
-      y_train, y_dev = y[train], y[dev]
-      
-      # Undo the embeding-lexicon merge for train
-      split_train = np.split(x_train, [75], axis=1)
-      emb_train = split_train[0]
-      lex_train = split_train[1]
-
-      # Undo the embeding-lexicon merge for dev
-      split_dev = np.split(x_dev, [75], axis=1)
-      emb_dev = split_dev[0]
-      lex_dev = split_dev[1]
-
-      # Train the model with the new HP
+      print(f'Training {self.num_folds - len(folds)} folds in {self.fold_workers} processes ...')
+    results = self._train_folds(hp, x, y, batch_size, copied_fit_kwargs, len(folds))
+
+    model = None
+    for fold_no, (scores, y_prob, trained, resources) in enumerate(results, len(folds) + 1):
+      # Every metric comes from the same prediction pass
+      folds.append(scores)
+      oof_prob[self._fold_plan[fold_no - 1][1]] = np.ravel(y_prob)
+
+      # Checkpoint of the finished fold: model, probabilities and, last, the scores
+      model = self._fold_model(hp, trained, model)
+      self.save_model(trial.trial_id, model)
+      if self.save_fold_weights:
+        self._save_fold_weights(trial.trial_id, fold_no, model.get_weights())
+      self._save_oof(trial.trial_id, oof_prob)
+      self._save_folds(trial.trial_id, folds)
+      self._telemetry[trial.trial_id]['folds'].append(dict(resources, fold=fold_no))
+      self._save_telemetry(trial.trial_id)
+
+      objective = [fold[objective_name] for fold in folds]
+      if self._should_prune(objective):
+        print(f'Pruning trial {trial.trial_id} after {fold_no} folds (mean {objective_name}: {np.mean(objective)})')
+        self._status[trial.trial_id] = PRUNED
+        results.close()
+        break
+
+    # Every fold was finished before the interruption: model of the checkpoint
+    # (the trial is not scored yet, its checkpoint is always step 0)
+    if model is None:
       model = self.hypermodel.build(hp)
-      model.fit([emb_train, lex_train], y_train, batch_size=batch_size, *fit_args, **copied_fit_kwargs)
+      model.load_weights(self._get_checkpoint_fname(trial.trial_id, 0))
 
-      # Store objective metric for this fold
-      objective.append(model.evaluate([emb_dev, lex_dev], y_dev))
-      
-      # Calculate precision, recall and f1
-      y_prob = model.predict([emb_dev, lex_dev], batch_size=128, verbose=0)
-      y_classes = np.around(y_prob, decimals=0)
-      y_pred = y_classes.astype(int)
-      precision_per_fold.append(precision_score(y_dev, y_pred, average="macro"))
-      recall_per_fold.append(recall_score(y_dev, y_pred, average="macro"))
-      f1_per_fold.append(f1_score(y_dev, y_pred, average="macro"))
+    objective = [fold[objective_name] for fold in folds]
 
-      fold_no = fold_no + 1
+    # Decision threshold maximizing the out-of-fold macro F1
+    done = ~np.isnan(oof_prob)
+    threshold, oof_f1 = evaluate.best_threshold(y[done], oof_prob[done])
+    self._save_threshold(trial.trial_id, threshold, oof_f1)
 
     # Update and save trial
-    self.oracle.update_trial(trial.trial_id, {'accuracy': np.mean(objective)})
+    score = np.mean(objective)
+    if self._status.get(trial.trial_id) == PRUNED:
+      score = pruned_score(score, self._full_scores(), self.oracle.objective.direction)
+    self.oracle.update_trial(trial.trial_id, {objective_name: score})
     self.save_model(trial.trial_id, model)
     print("----------------------------------------------")
-    print("Average scores for all folds:")
-    print(f"> Precision macro: {np.mean(precision_per_fold)}")
-    print(f"> Recall macro: {np.mean(recall_per_fold)}")
-    print(f"> F1 macro: {np.mean(f1_per_fold)}")
+    print(f"Average scores for {len(folds)} folds:")
+    print(f"> Precision macro: {np.mean([fold['precision_macro'] for fold in folds])}")
+    print(f"> Recall macro: {np.mean([fold['recall_macro'] for fold in folds])}")
+    print(f"> F1 macro: {np.mean([fold['f1_macro'] for fold in folds])}")
+    print(f"> Threshold: {threshold:.4f} (out-of-fold F1 macro: {oof_f1})")
+    if all('epochs' in fold for fold in folds):
+      print(f"> Epochs run per fold: {[fold['epochs'] for fold in folds]} (best: {[fold['best_epoch'] for fold in folds]})")
     print("----------------------------------------------")
+
+    # Pruned trials only have a partial objective
+    if self.cache is not None and trial.trial_id not in self._status:
+      self.cache.store(key, self, trial.trial_id, {objective_name: np.mean(objective)})
+
+  # Train the folds of the plan from `first_fold` on, one after another or in the fold processes
+  # Yields: (scores, y_prob, model or weights, resources) per fold, in fold order
+  def _train_folds(self, hp, x, y, batch_size, fit_kwargs, first_fold=0):
+    if self.fold_workers > 1:
+      yield from crossval.run_folds(self._fold_pool(x, y), hp, self._fold_plan[first_fold:], batch_size, fit_kwargs,
+                                    self.val_split, self.patience)
+      return
+
+    # Build and compile the model with the new HP once per trial, seeded as in the fold processes
+    model = crossval.build_model(self.hypermodel, hp, self.seed)
+    initial_weights = model.get_weights()
+
+    for fold_no, (train, dev) in enumerate(self._fold_plan[first_fold:], first_fold + 1):
+      print('--------------------------------')
+      print(f'Training for fold {fold_no} ...')
+
+      # Every fold starts from the same initial weights and a fresh optimizer
+      crossval.reset_model(model, initial_weights)
+      yield crossval.train_fold(model,
+                                crossval.take(x, train), y[train],
+                                crossval.take(x, dev), y[dev],
+                                batch_size, fit_kwargs,
+                                self.val_split, self.patience, self.seed)
+
+  # Model of a finished fold (the fold processes only send back its weights)
+  def _fold_model(self, hp, trained, model=None):
+    if self.fold_workers == 1:
+      return trained
+    if model is None:
+      model = self.hypermodel.build(hp)
+    model.set_weights(trained)
+    return model
+
+  # Median stopping at fold granularity: after `prune_after` folds, stop a trial whose
+  # running mean is worse than the median of the completed trials over the same folds
+  def _should_prune(self, objective):
+    k = len(objective)
+    if not self.prune_after or k < self.prune_after or k == self.num_folds:
+      return False
+
+    partial_means = []
+    for completed in self.oracle.get_best_trials(num_trials=100000):
+      folds = [fold[self.oracle.objective.name] for fold in self._load_folds(completed.trial_id)]
+      if len(folds) >= k:
+        partial_means.append(np.mean(folds[:k]))
+
+    if len(partial_means) < self.prune_min_trials:
+      return False
+
+    if self.oracle.objective.direction == 'max':
+      return np.mean(objective) < np.median(partial_means)
+    return np.mean(objective) > np.median(partial_means)
+
+  # Scores of the trials with every fold of the plan finished
+  def _full_scores(self):
+    scores = []
+    for completed in self.oracle.get_best_trials(num_trials=100000):
+      if len(self._load_folds(completed.trial_id)) == self.num_folds:
+        scores.append(completed.score)
+    return scores
+
+  # Files stored next to the checkpoint of a trial
+  def _trial_fname(self, trial_id, name):
+    return os.path.join(self.get_trial_dir(trial_id), name)
+
+  # Scores of every finished fold of a trial
+  # Written to a temporary file first: an interrupted write never leaves a truncated file
+  def _save_folds(self, trial_id, folds):
+    fname = self._trial_fname(trial_id, 'folds.json')
+    with open(fname + '.tmp', 'w') as f:
+      json.dump(folds, f)
+    os.replace(fname + '.tmp', fname)
+
+  def _load_folds(self, trial_id):
+    if not os.path.exists(self._trial_fname(trial_id, 'folds.json')):
+      return []
+    with open(self._trial_fname(trial_id, 'folds.json')) as f:
+      return json.load(f)
+
+  # Out-of-fold probabilities of the finished folds of a trial (NaN for the others),
+  # stored as `oof_dtype` and computed with in float64
+  def _save_oof(self, trial_id, oof_prob):
+    fname = self._trial_fname(trial_id, 'oof.npy')
+    with open(fname + '.tmp', 'wb') as f:
+      np.save(f, oof_prob.astype(self.oof_dtype))
+    os.replace(fname + '.tmp', fname)
+
+  def _load_oof(self, trial_id, num_samples):
+    if not os.path.exists(self._trial_fname(trial_id, 'oof.npy')):
+      return np.full(num_samples, np.nan)
+    return np.load(self._trial_fname(trial_id, 'oof.npy')).astype('float64')
+
+  # Weights of every fold: arrays in the weight store of the project, shared by every trial,
+  # and the keys of each fold in the trial directory
+  def _weight_store(self):
+    return os.path.join(self.project_dir, 'fold_weights')
+
+  def _save_fold_weights(self, trial_id, fold_no, weights):
+    fname = self._trial_fname(trial_id, 'fold_weights.json')
+    manifest = {}
+    if os.path.exists(fname):
+      with open(fname) as f:
+        manifest = json.load(f)
+    manifest[str(fold_no)] = crossval.save_weights(self._weight_store(), weights)
+    with open(fname + '.tmp', 'w') as f:
+      json.dump(manifest, f)
+    os.replace(fname + '.tmp', fname)
+
+  # Model of one fold of a trial stored with --save_fold_weights (folds numbered from 1)
+  def load_fold_model(self, trial_id, fold_no):
+    with open(self._trial_fname(trial_id, 'fold_weights.json')) as f:
+      keys = json.load(f)[str(fold_no)]
+    model = self.hypermodel.build(self.oracle.get_trial(trial_id).hyperparameters)
+    model.set_weights(crossval.load_weights(self._weight_store(), keys))
+    return model
+
+  # Decision threshold of a trial, tuned on its out-of-fold probabilities
+  def _save_threshold(self, trial_id, threshold, f1_macro):
+    with open(self._trial_fname(trial_id, 'threshold.json'), 'w') as f:
+      json.dump({'threshold': threshold, 'f1_macro': f1_macro}, f)
+
+  def load_threshold(self, trial_id):
+    if not os.path.exists(self._trial_fname(trial_id, 'threshold.json')):
+      return 0.5
+    with open(self._trial_fname(trial_id, 'threshold.json')) as f:
+      return json.load(f)['threshold']
+
+  # Every trial releases its models (graphs and weights) when it ends, and the resident
+  # memory is checked after it (see parallel.MemoryGuard)
+  def on_trial_end(self, trial):
+    super(CVTuner, self).on_trial_end(trial)
+
+    self._save_telemetry(trial.trial_id)
+    del self._telemetry[trial.trial_id]
+
+    tf.keras.backend.clear_session()
+    gc.collect()
+    self.memory_guard.check(trial.trial_id)
+
+  def on_trial_begin(self, trial):
+    super(CVTuner, self).on_trial_begin(trial)
+    self._telemetry[trial.trial_id] = {'meter': telemetry.Meter().start(), 'folds': [], 'cached': False}
+
+  # Resources of a trial (see telemetry.Meter): the trial in this process, every fold and
+  # the serving cost. Rewritten after every fold and when the trial ends
+  def _save_telemetry(self, trial_id):
+    state = self._telemetry[trial_id]
+    folds = state['folds']
+    record = state['meter'].stop().record(trial_id=trial_id,
+                                          status=self._status.get(trial_id, self.oracle.get_trial(trial_id).status),
+                                          cached=state['cached'],
+                                          fold_workers=self.fold_workers,
+                                          epochs=sum(fold['epochs'] for fold in folds),
+                                          cost=evaluate.load_cost(self.get_trial_dir(trial_id)),
+                                          folds=folds)
+
+    # Fold processes are not part of the CPU time and memory of this process
+    if self.fold_workers > 1:
+      record['cpu_seconds'] += sum(fold['cpu_seconds'] for fold in folds)
+      record['cpu_utilization'] = record['cpu_seconds'] / max(record['wall_seconds'], 1e-9) / parallel.available_cores()
+    record['peak_rss'] = max([record['peak_rss']] + [fold['peak_rss'] for fold in folds])
+
+    telemetry.save(self.get_trial_dir(trial_id), record)
+
+  # Static cost (see costmodel.model_cost) and inference latency (see evaluate.serving_cost)
+  # of a configuration, stored in the trial directory. The weights do not matter, the model
+  # is not trained
+  def _serving_cost(self, trial_id, hp, x, num_samples=512):
+    model = self.hypermodel.build(hp)
+    cost = costmodel.model_cost(model)
+    cost.update(evaluate.serving_cost(model, crossval.take(x, np.arange(min(num_samples, len(x[0]))))))
+    evaluate.save_cost(self.get_trial_dir(trial_id), cost)
+
+    # The measured model is released before the trial builds its own
+    del model
+    tf.keras.backend.clear_session()
+    return cost
+
+  # Fold processes are started once and reused by every trial
+  def _fold_pool(self, x, y):
+    if self._pool is None:
+      self._pool = crossval.fold_pool(self.hypermodel, self.fold_workers, x, y, self.fold_threads, self.seed)
+    return self._pool
+
+  # Inputs and fold plan are prepared once and shared by every trial
+  def search(self, x, y, *fit_args, **fit_kwargs):
+    x = crossval.as_inputs(x)
+    y = np.asarray(y)
+    self._fold_plan = crossval.fold_plan(y, self.num_folds)
+    if self.cache is not None:
+      self._fingerprint = resultcache.fingerprint(x, y)
+    super(CVTuner, self).search(x, y, *fit_args, **fit_kwargs)
+
+  def on_search_end(self):
+    if self._pool is not None:
+      self._pool.shutdown()
+      self._pool = None
+    super(CVTuner, self).on_search_end()
     
+# Score of a pruned trial: the mean of its finished folds, strictly worse than every fully
+# cross-validated trial (its first folds may be easier than the others, so the partial mean
+# alone could beat them), or the worst score when there is none yet
+# A pruned trial is never the best trial of the search
+def pruned_score(partial_mean, full_scores, direction):
+  if not full_scores:
+    return costmodel.worst_score(direction)
+  if direction == 'max':
+    return min(partial_mean, np.nextafter(min(full_scores), -np.inf))
+  return max(partial_mean, np.nextafter(max(full_scores), np.inf))
+
+# Bayesian optimization whose Gaussian process also fits the trials of previous searches
+# Those trials only inform the proposals: they do not count as trials of this search
+# and are never returned as best trials
+class WarmStartBayesianOptimization(costmodel.BudgetBayesianOptimization):
+  def __init__(self, *args, warm_trials=(), **kwargs):
+    super(WarmStartBayesianOptimization, self).__init__(*args, **kwargs)
+    self.warm_trials = {trial.trial_id: trial for trial in warm_trials}
+
+  def _populate_space(self, trial_id):
+    trials = self.trials
+    self.trials = dict(self._usable_warm_trials(), **trials)
+    try:
+      return super(WarmStartBayesianOptimization, self)._populate_space(trial_id)
+    finally:
+      self.trials = trials
+
+  # Previous trials with a value inside the current search space for every tunable
+  # hyperparameter (a missing value would be filled with its default, a point never evaluated)
+  def _usable_warm_trials(self):
+    usable = {}
+    tunable = [hp for hp in self.hyperparameters.space if not isinstance(hp, kt.engine.hyperparameters.Fixed)]
+    for trial_id, trial in self.warm_trials.items():
+      values = trial.hyperparameters.values
+      if all(hp.name in values and _in_space(hp, values[hp.name]) for hp in tunable):
+        usable[trial_id] = trial
+    return usable
+
+# Ranges with a step only take the values of the grid min_value + k * step (whatever the
+# sampling, see kt.engine.hyperparameters.cumulative_prob_to_value)
+def _in_space(hp, value):
+  if isinstance(hp, kt.engine.hyperparameters.Choice):
+    return value in hp.values
+  if isinstance(hp, (kt.engine.hyperparameters.Int, kt.engine.hyperparameters.Float)):
+    if not hp.min_value <= value <= hp.max_value:
+      return False
+    if hp.step:
+      steps = (value - hp.min_value) / hp.step
+      return abs(steps - round(steps)) < 1e-6
+    return True
+  return True
+
+# Completed cross-validated trials (with folds.json) of previous searches
+def load_trials(project_dirs, objective):
+  trials = []
+  for project_dir in project_dirs:
+    for fname in sorted(glob.glob(os.path.join(project_dir, 'trial_*', 'trial.json'))):
+      if not os.path.exists(os.path.join(os.path.dirname(fname), 'folds.json')):
+        continue
+      with open(fname) as f:
+        trial = kt.engine.trial.Trial.from_state(json.load(f))
+      if trial.status == 'COMPLETED' and trial.metrics.exists(objective):
+        trials.append(trial)
+  return trials
+
 def main(args):
   print("Version", tf.__version__)
   print("Device", tf.test.gpu_device_name())
   print("GPUS", tf.config.list_physical_devices('GPU'))
 
   # Data loading
-  path = '../data/HaterNet/'
-
-  training_set = pd.read_csv(path + 'train_prep_uncased.tsv', sep='\t')
-  test_set = pd.read_csv(path + 'test_prep_uncased.tsv', sep='\t')
-
-  # Remove accents from train
-  x_train = training_set.text
-  y_train = training_set.label
-  
-  # Remove accents from test
-  x_test = test_set.text
-  y_test = test_set.label
-  
-  # Normalize dataset for the lexicon matching
-  norm_train = training_set.text.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-  norm_test = test_set.text.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
+  x_train, y_train, x_test, y_test = loaddata.load_dataset(args.dataset)
 
   # Lexicon loading
-  if args.lexicon == 'sel':
-    lexicon = loadfeatures.SEL(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'liwc':
-    lexicon = loadfeatures.SpanishLIWC(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  elif args.lexicon == 'all':
-    lexicon = loadfeatures.All(path='../lexicons/')
-    lex_train = lexicon.process(dataset=norm_train)
-    lex_test = lexicon.process(dataset=norm_test)
-  else:
-    print("No se utilizará lexicon.")
-    
-  # Store each tweet as a list of tokens
-  token_list = []
-  for text in x_train:
-    token_list.append(preprocessing.text.text_to_word_sequence(text))
-
-  # For each list of tokens, store its length
-  len_texts = []
-  for index, tweet in enumerate(token_list):
-    len_texts.append(len(tweet))
+  lex_train, lex_test = loaddata.load_lexicon(args.lexicon, [x_train, x_test])
 
   # Tokenize
-  max_words = 10000   # Top most frequent words
-  max_seq = 75       # Size to be padded to (should be greater than the max value=70)
-
-  # Create a tokenize that takes the 10000 most common words
-  tokenizer = preprocessing.text.Tokenizer(num_words=max_words)
+  max_seq = loaddata.MAX_SEQ
 
   # Fit the tokenizer to the dataset
-  tokenizer.fit_on_texts(x_train)
+  tokenizer = loaddata.fit_tokenizer(x_train)
 
   # Dictionary ordered by total frequency
   word_index = tokenizer.word_index
   vocab_size = len(word_index) + 1
 
-  # Transform each tweet into a numerical sequence
-  train_sequences = tokenizer.texts_to_sequences(x_train)
-  test_sequences = tokenizer.texts_to_sequences(x_test)
-
-  # Fill each sequence with zeros until max_seq
-  x_train = preprocessing.sequence.pad_sequences(train_sequences, maxlen=max_seq)
-  x_test = preprocessing.sequence.pad_sequences(test_sequences, maxlen=max_seq)
+  # Transform each tweet into a padded numerical sequence
+  x_train = loaddata.to_sequences(tokenizer, x_train, max_seq)
+  x_test = loaddata.to_sequences(tokenizer, x_test, max_seq)
 
   # Load embeddings
   path = '../embeddings/embeddings-l-model.vec'
@@ -198,31 +487,68 @@ def main(args):
   ]
 
   
-  if args.lexicon:
-    model = buildmodel.LSTMFeaturesModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, args.lexicon, METRICS)
-
-  else:
-    # Create a model instance for the tuner
-    if args.model == 'lstm':
-      model = buildmodel.LSTMModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    elif args.model == 'bilstm':
-      model = buildmodel.BiLSTMModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    elif args.model == 'cnn':
-      model = buildmodel.CNNModel(vocab_size, max_seq, embedding_matrix, EMB_DIM, METRICS)
-    else:
-      print("Wrong model. Please, choose another one.")
-      exit()
+  # Hypermodel of the model (see buildmodel.MODELS), with the lexicon features if given
+  num_emotions = len(lex_train.columns) if args.lexicon else None
+  model = buildmodel.get_hypermodel(args.model, vocab_size, max_seq, embedding_matrix, EMB_DIM, num_emotions, METRICS)
   
+  epochs = 10
+
+  # Search algorithm: only configurations within the FLOPs and parameters budgets are proposed
+  if args.search == 'hyperband':
+    oracle = costmodel.BudgetHyperband(
+      objective=kt.Objective("accuracy", direction="max"),          # Optimizing metric
+      max_epochs=epochs,                                            # Largest budget of a trial
+      factor=args.factor,                                           # Fraction (1/factor) promoted to each budget
+      hypermodel=model,                                             # Model whose cost is checked
+      max_flops=args.max_flops,                                     # FLOPs per tweet budget
+      max_params=args.max_params                                    # Trainable parameters budget
+    )
+  else:
+    # Trials of previous searches (read before this search overwrites its project)
+    warm_trials = []
+    if args.warm_start is not None:
+      project_dirs = args.warm_start or ['../hp_trials/' + args.model + "_" + str(args.lexicon)]
+      warm_trials = load_trials(project_dirs, "accuracy")
+      print(f"Warm start: {len(warm_trials)} previous trials (those outside the search space are not used)")
+
+    oracle = WarmStartBayesianOptimization(
+      objective=kt.Objective("accuracy", direction="max"),          # Optimizing metric
+      max_trials=args.trials,                                       # Number of trials, default=10
+      warm_trials=warm_trials,                                      # Previous trials fitted by the Gaussian process
+      hypermodel=model,                                             # Model whose cost is checked
+      max_flops=args.max_flops,                                     # FLOPs per tweet budget
+      max_params=args.max_params                                    # Trainable parameters budget
+    )
+
+  # Results shared by every search of this model, lexicon and dataset
+  cache = None
+  if args.cache:
+    cache = resultcache.ResultCache(args.cache, model=args.model, lexicon=args.lexicon, dataset=args.dataset)
+
   # Create the tuner
   tuner = CVTuner(
       hypermodel=model,                                             # Model's function name
-      oracle=kt.oracles.BayesianOptimization(
-        objective=kt.Objective("accuracy", direction="max"),         # Optimizing metric
-        max_trials=args.trials                                      # Number of trials, default=10
-      ),  
+      oracle=oracle,                                                # Search algorithm
       directory='../hp_trials/',                                    # Directory to store the models
-      project_name=args.model + "_" + args.lexicon,                 # Project name
-      overwrite=True)                                               # Overwrite the project
+      project_name=args.model + "_" + str(args.lexicon),            # Project name
+      fold_workers=args.fold_workers,                               # Folds trained in parallel
+      fold_threads=args.fold_threads,                               # Threads per fold process
+      prune_after=args.prune_after,                                 # Folds before pruning unpromising trials
+      cache=cache,                                                  # Results of already evaluated configurations
+      batch_sizes=args.batch_sizes,                                 # Batch sizes to tune
+      max_latency=args.max_latency,                                 # Single-tweet latency budget
+      max_flops=args.max_flops,                                     # FLOPs per tweet budget
+      max_params=args.max_params,                                   # Trainable parameters budget
+      val_split=args.val_split,                                     # Inner validation slice for early stopping
+      patience=args.patience,                                       # Epochs without improvement before stopping
+      oof_dtype=args.oof_dtype,                                     # Precision of the stored out-of-fold probabilities
+      save_fold_weights=args.save_fold_weights,                     # Store the weights of every fold
+      max_rss_growth=args.max_rss_growth and args.max_rss_growth * 2**20,  # Memory growth limit (bytes)
+      overwrite=not (args.resume or parallel.is_distributed()))     # Overwrite the project (done by the launcher in parallel mode)
+
+  # Workers coordinate through the project directory
+  if parallel.is_shared():
+    parallel.share_oracle(tuner.oracle)
 
   '''
   class_weights = class_weight.compute_class_weight('balanced',
@@ -233,28 +559,53 @@ def main(args):
   '''
 
   # Early stopping and tensorboard callbacks for fitting
-  callbacks = [
+  # (with --val_split every fold stops on its validation loss instead, see crossval.train_fold)
+  callbacks = [] if args.val_split else [
       EarlyStopping(monitor='loss', verbose=1, patience=5)
   ]
 
   print("Searching...")
   if args.lexicon:
-    tuner.search(x=[x_train, lex_train], y=y_train, verbose=0, callbacks=callbacks, epochs=10)
+    tuner.search(x=[x_train, lex_train], y=y_train, verbose=0, callbacks=callbacks, epochs=epochs)
   else:
-    tuner.search(x=x_train, y=y_train, verbose=0, callbacks=callbacks, epochs=10)
+    tuner.search(x=x_train, y=y_train, verbose=0, callbacks=callbacks, epochs=epochs)
+
+  # Workers only run trials, the chief reports the results
+  if parallel.is_worker():
+    return
+
+  # tuner0 reports once every shared-directory worker has finished its trial
+  if parallel.is_shared():
+    tuner.oracle.wait()
 
   # Save the best model
   best_model = tuner.get_best_models(num_models=1)
   print(tuner.results_summary(num_trials=1))
 
+  # Pareto front of the objective and the single-tweet latency
+  measured = [(t, evaluate.load_cost(tuner.get_trial_dir(t.trial_id))) for t in tuner.oracle.get_best_trials(num_trials=100000)]
+  measured = [(t, cost) for t, cost in measured if cost and not costmodel.over_budget(cost, tuner.budget)]
+  front = evaluate.pareto_front([t.score for t, _ in measured], [cost['latency_ms'] for _, cost in measured])
+  print('\nPARETO FRONT (accuracy vs single-tweet latency)\n')
+  for i in front:
+    trial, cost = measured[i]
+    print(f"Trial {trial.trial_id}: accuracy {trial.score:.4f} - {cost['latency_ms']:.2f} ms/tweet - {cost['batch_latency_ms']:.3f} ms/tweet batched - {cost['params']} params")
+
+  # Decision threshold of the best trial
+  threshold = tuner.load_threshold(tuner.oracle.get_best_trials(num_trials=1)[0].trial_id)
+  print(f"Decision threshold: {threshold:.4f}")
+
   # Statistics
   if args.lexicon:
     y_prob = best_model[0].predict([np.array(x_test), lex_test], batch_size=128, verbose=1)
   else:
     y_prob = best_model[0].predict(np.array(x_test), batch_size=128, verbose=1)
     
-  y_classes = np.around(y_prob, decimals=0)
-  y_pred = y_classes.astype(int)
+  y_pred = (y_prob > threshold).astype(int)
+
+  test_scores = evaluate.evaluate_probs(y_test, y_prob, threshold)
+  print('\nTEST SCORES\n')
+  print(f"loss: {test_scores['loss']:.4f} - accuracy: {test_scores['accuracy']:.4f} - auc: {test_scores['auc']:.4f} - f1 macro: {test_scores['f1_macro']:.4f}")
 
   print('\nCLASSIFICATION REPORT\n')
   print(classification_report(y_test, y_pred, digits=4))
@@ -262,10 +613,21 @@ def main(args):
   print('\nCONFUSION MATRIX\n')
   print(confusion_matrix(y_test, y_pred))
 
+  # Standalone serving artifact
+  if args.export:
+    if args.lexicon:
+      representative_data = [x_train, lex_train.to_numpy()]
+    else:
+      representative_data = x_train
+    export.export_artifact(best_model[0], tokenizer, max_seq, args.lexicon, args.export, args.quantize, representative_data,
+                           threshold=threshold)
+
   print("\nParameters used:")
   print(args.model + " model")
+  print(args.search + " search")
   print(str(args.trials) + " trials")
-  print(args.lexicon + " lexicon")
+  print(str(args.lexicon) + " lexicon")
+  print(f"Decision threshold: {threshold:.4f}")
   
 if __name__ == "__main__":
   
@@ -283,7 +645,7 @@ if __name__ == "__main__":
 
   ap.add_argument("-m", 
                   "--model",
-                  choices=['lstm','bilstm','cnn'],
+                  choices=list(buildmodel.MODELS),
                   default='lstm',
                   help="Model to be built")
 
@@ -300,5 +662,149 @@ if __name__ == "__main__":
                   help="Name of the lexicon to infuse")
 
 
+  ap.add_argument("-e",
+                  "--export",
+                  default=None,
+                  help="Directory to export the best model as a serving artifact")
+
+  ap.add_argument("-q",
+                  "--quantize",
+                  choices=['none', 'dynamic', 'int8'],
+                  default='dynamic',
+                  help="TFLite quantization of the exported model")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='haternet',
+                  help="Dataset to train with")
+
+  ap.add_argument("-w",
+                  "--workers",
+                  type=int,
+                  default=1,
+                  help="Number of local worker processes running trials in parallel")
+
+  ap.add_argument("--threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow threads per process (default: $TF_INTRA_OP_THREADS, $SLURM_CPUS_PER_TASK or cores / workers)")
+
+  ap.add_argument("--inter_threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow inter-op threads per process (default: $TF_INTER_OP_THREADS or min(threads, 2))")
+
+  ap.add_argument("--affinity",
+                  default=None,
+                  help="CPU list to pin this process to (e.g. 0-7), or 'auto' to pin every -w worker to its own cores")
+
+  ap.add_argument("--fold_workers",
+                  type=int,
+                  default=1,
+                  help="Number of processes training the folds of a trial in parallel")
+
+  ap.add_argument("--fold_threads",
+                  type=int,
+                  default=None,
+                  help="TensorFlow threads per fold process (default: cores / fold workers)")
+
+  ap.add_argument("--prune_after",
+                  type=int,
+                  default=0,
+                  help="Prune trials worse than the median after this many folds (0 = never); pruned trials still count toward -t and are scored with the mean of their finished folds, capped below every fully cross-validated trial")
+
+  ap.add_argument("--val_split",
+                  type=float,
+                  default=0.1,
+                  help="Training fraction of every fold held out to stop on its loss and keep the best epoch (0 = stop on the training loss)")
+
+  ap.add_argument("--patience",
+                  type=int,
+                  default=3,
+                  help="Epochs without a better validation loss before a fold stops")
+
+  ap.add_argument("--oof_dtype",
+                  choices=['float16', 'float32'],
+                  default='float32',
+                  help="Precision of the out-of-fold probabilities stored in every trial (oof.npy)")
+
+  ap.add_argument("--save_fold_weights",
+                  action='store_true',
+                  help="Store the weights of every fold (arrays shared between folds and trials are stored once)")
+
+  ap.add_argument("--max_rss_growth",
+                  type=int,
+                  default=None,
+                  help="Stop the search when the resident memory grows more than this many MB over the level after the first trial")
+
+  ap.add_argument("-s",
+                  "--search",
+                  choices=['bayesian', 'hyperband'],
+                  default='bayesian',
+                  help="Search algorithm (hyperband ignores -t: its budget comes from the epochs and --factor)")
+
+  ap.add_argument("--factor",
+                  type=int,
+                  default=3,
+                  help="Hyperband reduction factor")
+
+  ap.add_argument("-r",
+                  "--resume",
+                  action='store_true',
+                  help="Continue the search stored in ../hp_trials/ instead of starting over")
+
+  ap.add_argument("--warm_start",
+                  nargs='*',
+                  default=None,
+                  help="Fit the Bayesian optimization to the trials of previous searches: project directories (default: the project of this search, "
+                       "only in a single process: -w and cpu_launcher_shared.sbs clear it first, copy it and pass the copy)")
+
+  ap.add_argument("--batch_sizes",
+                  type=int,
+                  nargs='+',
+                  default=buildmodel.BATCH_SIZES,
+                  help="Batch sizes to tune (see calibrate.py)")
+
+  ap.add_argument("--max_latency",
+                  type=float,
+                  default=None,
+                  help="Single-tweet latency budget in ms: slower configurations are not trained")
+
+  ap.add_argument("--max_flops",
+                  type=float,
+                  default=None,
+                  help="FLOPs per tweet budget: costlier configurations are never proposed (see spacecost.py)")
+
+  ap.add_argument("--max_params",
+                  type=int,
+                  default=None,
+                  help="Trainable parameters budget: larger configurations are never proposed (see spacecost.py)")
+
+  ap.add_argument("--cache",
+                  nargs='?',
+                  const='../hp_cache/',
+                  default=None,
+                  help="Reuse the results of already evaluated configurations stored in this directory (default: ../hp_cache/)")
+
+  ap.add_argument("--shared",
+                  action='store_true',
+                  help="Workers coordinate through the project directory instead of a chief oracle (one worker per srun task, or -w local workers)")
+
   args = ap.parse_args()
+
+  if args.warm_start is not None and args.search != 'bayesian':
+    ap.error("--warm_start needs the bayesian search")
+
+  # Shared-directory search started by srun: this task is one of the workers
+  if args.shared and args.workers == 1:
+    parallel.join_shared()
+
+  # Parallel search: relaunch this command as chief + workers
+  if args.workers > 1 and not parallel.is_distributed():
+    project_dir = '../hp_trials/' + args.model + "_" + str(args.lexicon)
+    sys.exit(parallel.launch(args.workers, args.threads, project_dir, overwrite=not args.resume, shared=args.shared,
+                             affinity=args.affinity == 'auto'))
+
+  parallel.configure_threads(args.threads, args.inter_threads, args.affinity)
   main(args)
\ No newline at end of file
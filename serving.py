@@ -0,0 +1,159 @@
+# Scoring with an exported artifact (see export.py)
+# Only needs tensorflow at load time (no keras-tuner, no gensim)
+
+import export
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from tensorflow.keras import preprocessing
+
+class Scorer:
+
+  def __init__(self, path, backend='tflite', lexicon_path='../lexicons/'):
+    with open(os.path.join(path, export.METADATA_FILE), encoding='utf8') as f:
+      self.metadata = json.load(f)
+
+    with open(os.path.join(path, export.TOKENIZER_FILE), encoding='utf8') as f:
+      self.tokenizer = preprocessing.text.tokenizer_from_json(f.read())
+
+    self.max_seq = self.metadata['max_seq']
+
+    # The lexicon is only needed by models with a features' branch
+    self.lexicon = None
+    if self.metadata['lexicon']:
+      import loadfeatures
+      self.lexicon = loadfeatures.LEXICONS[self.metadata['lexicon']](path=lexicon_path)
+
+    self.backend = backend
+    if backend == 'tflite':
+      self.interpreter = tf.lite.Interpreter(model_path=os.path.join(path, export.TFLITE_FILE))
+      self.input_details = self._sort_inputs(self.interpreter.get_input_details())
+      self.output_index = self.interpreter.get_output_details()[0]['index']
+    elif backend == 'savedmodel':
+      self.model = tf.keras.models.load_model(os.path.join(path, export.SAVED_MODEL_DIR), compile=False)
+    else:
+      raise ValueError("Unknown backend: " + str(backend))
+
+  # Transform raw tweets into the model inputs
+  def features(self, texts):
+    texts = pd.Series(texts)
+    sequences = self.tokenizer.texts_to_sequences(texts)
+    x = [preprocessing.sequence.pad_sequences(sequences, maxlen=self.max_seq)]
+
+    if self.lexicon is not None:
+      import loadfeatures
+      x.append(self.lexicon.process(dataset=loadfeatures.normalize(texts)).to_numpy())
+
+    return x
+
+  # Probability of the positive class for already transformed inputs
+  def predict_features(self, x, batch_size=128):
+    if self.backend == 'savedmodel':
+      inputs = x if len(x) > 1 else x[0]
+      return self.model.predict(inputs, batch_size=batch_size, verbose=0).ravel()
+
+    y_prob = []
+    for start in range(0, len(x[0]), batch_size):
+      batch = [inp[start:start + batch_size] for inp in x]
+      y_prob.append(self._invoke(batch))
+
+    return np.concatenate(y_prob).ravel()
+
+  # Probability of the positive class for raw tweets
+  def predict(self, texts, batch_size=128):
+    return self.predict_features(self.features(texts), batch_size)
+
+  # Predicted labels for raw tweets
+  def classify(self, texts, batch_size=128):
+    return self.label(self.predict(texts, batch_size))
+
+  # Predicted labels for already computed probabilities
+  # Uses the decision threshold tuned before the export (0.5 for older artifacts)
+  def label(self, y_prob):
+    return (np.asarray(y_prob) > self.metadata.get('threshold', 0.5)).astype(int)
+
+  def _invoke(self, batch):
+    for detail, inp in zip(self.input_details, batch):
+      self.interpreter.resize_tensor_input(detail['index'], inp.shape)
+    self.interpreter.allocate_tensors()
+
+    for detail, inp in zip(self.input_details, batch):
+      self.interpreter.set_tensor(detail['index'], inp.astype(detail['dtype']))
+    self.interpreter.invoke()
+
+    return self.interpreter.get_tensor(self.output_index)
+
+  # Match the interpreter inputs with the Keras model inputs order
+  def _sort_inputs(self, details):
+    names = self.metadata['inputs']
+    if len(details) == 1:
+      return details
+
+    ordered = []
+    for name in names:
+      ordered.append(next(d for d in details if name.split(':')[0] in d['name']))
+
+    return ordered
+
+def main(args):
+  scorer = Scorer(args.artifact, backend=args.backend, lexicon_path=args.lexicons)
+
+  data = pd.read_csv(args.input, sep='\t')
+  texts = data[args.column]
+
+  y_prob = scorer.predict(texts, batch_size=args.batch_size)
+  data['prob'] = y_prob
+  data['pred'] = scorer.label(y_prob)
+
+  if args.output:
+    data.to_csv(args.output, sep='\t', index=False)
+  else:
+    print(data[[args.column, 'prob', 'pred']].to_string())
+
+if __name__ == "__main__":
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-a",
+                  "--artifact",
+                  required=True,
+                  help="Directory of the exported artifact")
+
+  ap.add_argument("-i",
+                  "--input",
+                  required=True,
+                  help="TSV file with the tweets to score")
+
+  ap.add_argument("-c",
+                  "--column",
+                  default='text',
+                  help="Column with the tweets' text")
+
+  ap.add_argument("-o",
+                  "--output",
+                  default=None,
+                  help="TSV file to write the predictions to")
+
+  ap.add_argument("-b",
+                  "--backend",
+                  choices=['tflite', 'savedmodel'],
+                  default='tflite',
+                  help="Runtime used to score")
+
+  ap.add_argument("--batch_size",
+                  type=int,
+                  default=128,
+                  help="Scoring batch size")
+
+  ap.add_argument("--lexicons",
+                  default='../lexicons/',
+                  help="Directory with the lexicons")
+
+  args = ap.parse_args()
+  main(args)
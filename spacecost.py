@@ -0,0 +1,109 @@
+# Static cost of a search space
+# Input parameters (-m model, -l lexicon, --max_flops, --max_params)
+# Computes the parameters, FLOPs per tweet and activation memory of every configuration
+# of the search space without training (see costmodel.py) and prints their distribution,
+# to choose the budgets of run.py and run_cv.py (--max_flops, --max_params)
+
+import loaddata
+import buildmodel
+import calibrate
+import costmodel
+
+import argparse
+import json
+import numpy as np
+import tensorflow as tf
+import random
+
+# Reported entries of the cost: (name, label, scale)
+COLUMNS = [('trainable_params', 'trainable params', 1),
+           ('flops', 'MFLOPs/tweet', 1e6),
+           ('activation_bytes', 'activation KB/tweet', 2**10)]
+
+def main(args):
+  hypermodel, _, _, _ = calibrate.prepare_hypermodel(args.model, args.lexicon, args.dataset)
+  structural, results = costmodel.space_costs(hypermodel)
+  budget = {'flops': args.max_flops, 'trainable_params': args.max_params}
+
+  # Distinct architectures, most expensive first
+  architectures = {}
+  for values, cost in results:
+    architectures[tuple(values[name] for name in structural)] = cost
+  ranked = sorted(architectures.items(), key=lambda item: -item[1]['flops'])
+
+  within = [values for values, cost in results if not costmodel.over_budget(cost, budget)]
+
+  print("----------------------------------------------")
+  print(f"Static cost of the {args.model} search space ({args.lexicon} lexicon): {len(results)} configurations, {len(architectures)} architectures")
+  print(f"> Structural hyperparameters: {', '.join(structural)}")
+  print("> cost | min | 25% | median | 75% | max")
+  for name, label, scale in COLUMNS:
+    q = np.percentile([cost[name] for _, cost in results], [0, 25, 50, 75, 100]) / scale
+    print(f"> {label} | {q[0]:.2f} | {q[1]:.2f} | {q[2]:.2f} | {q[3]:.2f} | {q[4]:.2f}")
+  print(f"> Params (with the frozen embeddings): {results[0][1]['params'] - results[0][1]['trainable_params']} + trainable")
+  print(f"> Within the budget: {len(within)} of {len(results)} configurations ({len(within) / len(results):.0%})")
+  print("> Most expensive architectures:")
+  for key, cost in ranked[:args.top]:
+    config = ', '.join(f'{name}={value}' for name, value in zip(structural, key))
+    print(f"> {config} | {cost['trainable_params']} params | {cost['flops'] / 1e6:.2f} MFLOPs | {cost['activation_bytes'] / 2**10:.1f} KB")
+  print("----------------------------------------------")
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'model': args.model, 'lexicon': args.lexicon, 'structural': structural,
+                 'architectures': [dict(zip(structural, key), **cost) for key, cost in ranked]}, f, indent=2, default=str)
+
+if __name__ == "__main__":
+
+  # Use the command below before running this script
+  # in order to guarantee reproducibility
+  # export PYTHONHASHSEED=0
+
+  seed = 1
+  np.random.seed(seed)
+  random.seed(seed)
+  tf.random.set_seed(seed)
+
+  # Args parse
+  ap = argparse.ArgumentParser()
+
+  ap.add_argument("-m",
+                  "--model",
+                  choices=list(buildmodel.MODELS),
+                  default='lstm',
+                  help="Model whose search space is analyzed")
+
+  ap.add_argument("-l",
+                  "--lexicon",
+                  choices=['liwc', 'sel', 'emolex', 'isal', 'all'],
+                  default=None,
+                  help="Name of the lexicon to infuse")
+
+  ap.add_argument("-d",
+                  "--dataset",
+                  choices=list(loaddata.DATASETS),
+                  default='hateval',
+                  help="Dataset whose vocabulary sizes the embeddings")
+
+  ap.add_argument("--max_flops",
+                  type=float,
+                  default=None,
+                  help="FLOPs per tweet budget, to count the configurations within it")
+
+  ap.add_argument("--max_params",
+                  type=int,
+                  default=None,
+                  help="Trainable parameters budget, to count the configurations within it")
+
+  ap.add_argument("--top",
+                  type=int,
+                  default=10,
+                  help="Most expensive architectures to list")
+
+  ap.add_argument("-o",
+                  "--output",
+                  default=None,
+                  help="JSON file to store the cost of every architecture")
+
+  args = ap.parse_args()
+  main(args)
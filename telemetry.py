@@ -0,0 +1,61 @@
+import glob
+import json
+import os
+import time
+
+import parallel
+
+# Resource record of a trial, stored in its directory
+TELEMETRY_FILE = 'telemetry.json'
+
+# Wall time, CPU time (every thread of this process) and peak resident memory
+# of a piece of work: a fold or a whole trial
+class Meter:
+    def start(self):
+        parallel.reset_peak_rss()
+        self.started = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self.started
+        self.cpu_seconds = time.process_time() - self._cpu
+        self.peak_rss = parallel.rss(peak=True)
+        return self
+
+    # Measurements plus the given values
+    # CPU utilization: busy fraction of the cores available to this process
+    def record(self, **values):
+        return dict({
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'cpu_utilization': self.cpu_seconds / max(self.wall_seconds, 1e-9) / parallel.available_cores(),
+            'peak_rss': self.peak_rss
+        }, **values)
+
+def save(trial_dir, record):
+    fname = os.path.join(trial_dir, TELEMETRY_FILE)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(fname + '.tmp', fname)
+
+# Record of a trial, None if it has none
+def load(trial_dir):
+    if not os.path.exists(os.path.join(trial_dir, TELEMETRY_FILE)):
+        return None
+    with open(os.path.join(trial_dir, TELEMETRY_FILE)) as f:
+        return json.load(f)
+
+# Records of every trial of a project, with the hyperparameter values and score of the trial
+def load_project(project_dir):
+    records = []
+    for fname in sorted(glob.glob(os.path.join(project_dir, 'trial_*', 'trial.json'))):
+        record = load(os.path.dirname(fname))
+        if record is None:
+            continue
+        with open(fname) as f:
+            state = json.load(f)
+        record['values'] = state['hyperparameters']['values']
+        record['score'] = state['score']
+        records.append(record)
+    return records
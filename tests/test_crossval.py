@@ -0,0 +1,95 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+kt = pytest.importorskip('kerastuner')
+pytest.importorskip('sklearn')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crossval
+
+from tensorflow import keras
+
+SEED = 1
+FIT_KWARGS = {'epochs': 3, 'verbose': 0}
+
+# Small model with dropout, so the fold results also depend on the random operations
+class TinyModel(kt.HyperModel):
+    def build(self, hp):
+        inputs = keras.Input(shape=(8,))
+        x = keras.layers.Dense(hp.Int('units', 4, 8, step=4), activation='relu')(inputs)
+        x = keras.layers.Dropout(0.25)(x)
+        x = keras.layers.Dense(1, activation='sigmoid')(x)
+        model = keras.Model(inputs=inputs, outputs=x)
+        model.compile(loss='binary_crossentropy', optimizer=keras.optimizers.Adam(1e-2),
+                      metrics=[keras.metrics.BinaryAccuracy(name='accuracy')])
+        return model
+
+def _data():
+    rng = np.random.RandomState(0)
+    x = rng.rand(60, 8).astype('float32')
+    y = (x[:, 0] + x[:, 1] > 1).astype('float32')
+    return x, y
+
+def _folds_built_once(x, y, plan, val_split=0.0):
+    model = crossval.build_model(TinyModel(), kt.HyperParameters(), SEED)
+    initial_weights = model.get_weights()
+    results = []
+    for train, dev in plan:
+        crossval.reset_model(model, initial_weights)
+        scores, y_prob, _, _ = crossval.train_fold(model, x[train], y[train], x[dev], y[dev], 16, FIT_KWARGS,
+                                                   val_split, seed=SEED)
+        results.append((scores, y_prob))
+    return results
+
+def _folds_rebuilt(x, y, plan, val_split=0.0):
+    results = []
+    for train, dev in plan:
+        model = crossval.build_model(TinyModel(), kt.HyperParameters(), SEED)
+        scores, y_prob, _, _ = crossval.train_fold(model, x[train], y[train], x[dev], y[dev], 16, FIT_KWARGS,
+                                                   val_split, seed=SEED)
+        results.append((scores, y_prob))
+    return results
+
+def _assert_same(expected, actual):
+    assert len(expected) == len(actual)
+    for (scores_a, prob_a), (scores_b, prob_b) in zip(expected, actual):
+        np.testing.assert_allclose(prob_a, prob_b, rtol=1e-5, atol=1e-6)
+        for name in scores_a:
+            assert scores_a[name] == pytest.approx(scores_b[name], abs=1e-6), name
+
+# Building the model once per trial and resetting it between folds gives the same
+# fold results as building a fresh model for every fold (as a new fold process does)
+def test_reset_model_matches_rebuild():
+    x, y = _data()
+    plan = crossval.fold_plan(y, 3)
+    _assert_same(_folds_rebuilt(x, y, plan), _folds_built_once(x, y, plan))
+
+def test_reset_model_matches_rebuild_with_early_stopping():
+    x, y = _data()
+    plan = crossval.fold_plan(y, 3)
+    _assert_same(_folds_rebuilt(x, y, plan, 0.2), _folds_built_once(x, y, plan, 0.2))
+
+# A fold does not depend on the folds trained before it in the same process
+def test_fold_results_do_not_depend_on_order():
+    x, y = _data()
+    plan = crossval.fold_plan(y, 3)
+    forward = _folds_built_once(x, y, plan)
+    backward = _folds_built_once(x, y, plan[::-1])[::-1]
+    _assert_same(forward, backward)
+
+def test_reset_model_zeroes_the_optimizer():
+    x, y = _data()
+    model = crossval.build_model(TinyModel(), kt.HyperParameters(), SEED)
+    initial_weights = model.get_weights()
+    model.fit(x, y, **FIT_KWARGS)
+
+    crossval.reset_model(model, initial_weights)
+    for expected, actual in zip(initial_weights, model.get_weights()):
+        np.testing.assert_array_equal(expected, actual)
+    for variable in model.optimizer.variables():
+        assert not np.any(variable.numpy())
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+kt = pytest.importorskip('kerastuner')
+pytest.importorskip('sklearn')
+pytest.importorskip('pandas')
+pytest.importorskip('gensim')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_cv
+
+def _oracle(tmp_path, direction):
+    oracle = kt.oracles.RandomSearch(objective=kt.Objective('accuracy', direction=direction), max_trials=10, seed=1)
+    oracle._set_project_dir(str(tmp_path), 'project')
+    oracle.hyperparameters.Int('units', 1, 100)
+    return oracle
+
+def _finish(oracle, score):
+    trial = oracle.create_trial('tuner0')
+    oracle.update_trial(trial.trial_id, {'accuracy': score})
+    oracle.end_trial(trial.trial_id)
+    return trial.trial_id
+
+# Easier first folds: the partial mean of the pruned trial beats every full mean,
+# but the trial is still not the best one
+@pytest.mark.parametrize('direction, full, partial', [('max', [0.70, 0.72, 0.71], 0.90),
+                                                      ('min', [0.40, 0.38, 0.39], 0.10)])
+def test_pruned_trial_is_never_the_best(tmp_path, direction, full, partial):
+    oracle = _oracle(tmp_path, direction)
+    for score in full:
+        _finish(oracle, score)
+    pruned = _finish(oracle, run_cv.pruned_score(partial, full, direction))
+
+    best = oracle.get_best_trials(num_trials=len(full) + 1)
+    assert best[0].trial_id != pruned
+    assert best[-1].trial_id == pruned
+
+def test_pruned_score_keeps_a_worse_partial_mean():
+    assert run_cv.pruned_score(0.5, [0.70, 0.72], 'max') == 0.5
+    assert run_cv.pruned_score(0.9, [0.40, 0.38], 'min') == 0.9
+
+def test_pruned_score_is_strictly_worse_than_ties():
+    assert run_cv.pruned_score(0.70, [0.70, 0.70], 'max') < 0.70
+    assert run_cv.pruned_score(0.40, [0.40, 0.40], 'min') > 0.40
+
+def test_pruned_score_without_full_trials():
+    assert run_cv.pruned_score(0.9, [], 'max') == 0.0
+
+# Warm-start values must lie on the step grid of the current space
+def test_in_space_checks_the_step_grid():
+    units = kt.engine.hyperparameters.Int('units', 32, 256, step=32)
+    rate = kt.engine.hyperparameters.Float('rate', 0.1, 0.5, step=0.1)
+    free = kt.engine.hyperparameters.Float('lr', 1e-4, 1e-2, sampling='log')
+    assert run_cv._in_space(units, 96)
+    assert not run_cv._in_space(units, 100)
+    assert not run_cv._in_space(units, 288)
+    assert run_cv._in_space(rate, 0.3)
+    assert not run_cv._in_space(rate, 0.25)
+    assert run_cv._in_space(free, 3e-3)